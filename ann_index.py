@@ -0,0 +1,248 @@
+import heapq
+import os
+import tempfile
+import time
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+BYTE_BITS = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)  # set bits of every byte
+PROBE_SCAN_RATIO = 16  # a code looked up one by one costs about this many buckets measured in the numpy pass
+
+
+def save_arrays(path, **arrays):
+    # written to a temporary file next to path and swapped in like SnapshotCache.save, so a crash or a second
+    # thread building the same index never leaves half a file behind
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class KDTreeIndex:  # kd-tree over the feature vectors, exact search or approximate with a cap on leaves visited
+    def __init__(self, vectors, leaf_size=32, p=2):
+        self.p = p  # 2 for euclidean, 1 for manhattan
+        vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+        self.size = vectors.shape[0]
+        order = np.arange(self.size)
+        split_dim, split_value, left, right, start, end = [], [], [], [], [], []
+        stack = [(self.new_node(split_dim, split_value, left, right, start, end), 0, self.size)]
+        while stack:
+            node, first, last = stack.pop()
+            start[node], end[node] = first, last
+            if last - first <= leaf_size:
+                continue
+            points = vectors[order[first:last]]
+            dim = int(np.argmax(points.max(axis=0) - points.min(axis=0)))  # split the widest dimension
+            middle = (last - first) // 2
+            part = np.argpartition(points[:, dim], middle)
+            order[first:last] = order[first:last][part]
+            split_dim[node] = dim
+            split_value[node] = float(vectors[order[first + middle], dim])
+            left[node] = self.new_node(split_dim, split_value, left, right, start, end)
+            right[node] = self.new_node(split_dim, split_value, left, right, start, end)
+            stack.append((left[node], first, first + middle))
+            stack.append((right[node], first + middle, last))
+        self.order = order  # position in the tree -> row in the catalog
+        self.points = vectors[order]  # vectors in tree order so each leaf is one contiguous block
+        self.split_dim = np.array(split_dim, dtype=np.int64)
+        self.split_value = np.array(split_value, dtype=np.float64)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+
+    @staticmethod
+    def new_node(split_dim, split_value, left, right, start, end):
+        for column in (split_dim, left, right, start, end):
+            column.append(-1)
+        split_value.append(0.0)
+        return len(split_dim) - 1
+
+    def distance_terms(self, values):
+        return values * values if self.p == 2 else np.abs(values)
+
+    def query(self, vector, k, effort=None, exclude=None):
+        # k nearest rows as (rows, distances). effort caps how many leaves are scanned, None means exact search
+        vector = np.asarray(vector, dtype=np.float64)
+        split_dim, split_value = self.split_dim.tolist(), self.split_value.tolist()
+        left, right = self.left.tolist(), self.right.tolist()
+        best_rows = np.empty(0, dtype=np.int64)
+        best_terms = np.empty(0)
+        counter = 0
+        heap = [(0.0, counter, 0, np.zeros_like(vector))]  # (lower bound, tie breaker, node, per-dimension offsets)
+        leaves = 0
+        while heap:
+            bound, _, node, offsets = heapq.heappop(heap)
+            if len(best_terms) == k and bound >= best_terms.max():
+                break
+            while left[node] != -1:  # walk down to the nearest leaf, queueing the far side of every split
+                dim = split_dim[node]
+                gap = vector[dim] - split_value[node]
+                near, far = (left[node], right[node]) if gap < 0 else (right[node], left[node])
+                far_offsets = offsets.copy()
+                far_offsets[dim] = gap
+                far_bound = bound - self.distance_terms(offsets[dim]) + self.distance_terms(gap)
+                counter += 1
+                heapq.heappush(heap, (far_bound, counter, far, far_offsets))
+                node = near
+            first, last = self.start[node], self.end[node]
+            rows = self.order[first:last]
+            terms = self.distance_terms(self.points[first:last] - vector).sum(axis=1)
+            if exclude is not None:
+                keep = rows != exclude
+                rows, terms = rows[keep], terms[keep]
+            best_rows = np.concatenate([best_rows, rows])
+            best_terms = np.concatenate([best_terms, terms])
+            if len(best_terms) > k:
+                keep = np.argpartition(best_terms, k - 1)[:k]
+                best_rows, best_terms = best_rows[keep], best_terms[keep]
+            leaves += 1
+            if effort is not None and leaves >= effort:
+                break
+        order = np.argsort(best_terms, kind="stable")
+        distances = np.sqrt(best_terms[order]) if self.p == 2 else best_terms[order]
+        return best_rows[order], distances
+
+    def save(self, path):
+        save_arrays(path, p=self.p, order=self.order, points=self.points, split_dim=self.split_dim,
+                    split_value=self.split_value, left=self.left, right=self.right, start=self.start, end=self.end)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        index = cls.__new__(cls)
+        for name in ("order", "points", "split_dim", "split_value", "left", "right", "start", "end"):
+            setattr(index, name, arrays[name])
+        index.p = int(arrays["p"])
+        index.size = index.points.shape[0]
+        return index
+
+
+class RandomProjectionIndex:  # random hyperplane lsh for cosine, and for pearson when the vectors are centered first
+    def __init__(self, vectors, tables=8, bits=16, center=False, seed=0):
+        self.center = center  # pearson is the cosine of vectors with their own mean removed
+        self.vectors = self.prepare(np.asarray(vectors, dtype=np.float64), center)
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, self.vectors.shape[1]))
+        self.build_tables()
+
+    def build_tables(self):
+        # everything query needs that follows from vectors and planes, so it is not saved
+        self.size = self.vectors.shape[0]
+        self.powers = 1 << np.arange(self.planes.shape[1], dtype=np.int64)
+        codes = [self.codes(self.vectors, table) for table in range(self.planes.shape[0])]
+        self.buckets = [self.group(table_codes) for table_codes in codes]  # code -> rows, per table
+        self.bucket_codes = [np.array(list(buckets), dtype=np.int64) for buckets in self.buckets]  # sorted
+        self.row_buckets = [np.searchsorted(bucket_codes, table_codes)  # row -> its bucket in bucket_codes
+                            for bucket_codes, table_codes in zip(self.bucket_codes, codes)]
+        self.masks = {}  # radius -> xor masks of every code at most radius bits away
+        self.norms = np.linalg.norm(self.vectors, axis=1)
+
+    @staticmethod
+    def prepare(vectors, center):
+        return vectors - vectors.mean(axis=1, keepdims=True) if center else vectors
+
+    def codes(self, vectors, table):
+        # one integer per vector, bit b says which side of hyperplane b the vector is on
+        return ((vectors @ self.planes[table].T) > 0).astype(np.int64) @ self.powers
+
+    @staticmethod
+    def group(codes):
+        order = np.argsort(codes, kind="stable")
+        values, starts = np.unique(codes[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        return {code: order[first:last] for code, first, last in zip(values.tolist(), starts, ends)}
+
+    def probe(self, table, code, radius, picked):
+        # marks in picked the rows of every bucket whose code is at most radius bits away from code. a small radius
+        # looks those codes up one by one, a large one measures the distance to every bucket in one numpy pass
+        buckets = self.buckets[table]
+        bits = len(self.powers)
+        radius = min(radius, bits)
+        if sum(comb(bits, flips) for flips in range(radius + 1)) * PROBE_SCAN_RATIO <= len(buckets):
+            if radius not in self.masks:
+                self.masks[radius] = [int(sum(self.powers[list(positions)])) for flips in range(radius + 1)
+                                      for positions in combinations(range(bits), flips)]
+            for mask in self.masks[radius]:
+                rows = buckets.get(code ^ mask)
+                if rows is not None:
+                    picked[rows] = True
+            return
+        differing = self.bucket_codes[table] ^ code
+        distances = sum(BYTE_BITS[(differing >> shift) & 255] for shift in range(0, bits, 8))
+        picked |= (distances <= radius)[self.row_buckets[table]]
+
+    def query(self, vector, k, effort=None, exclude=None):
+        # effort is the multi-probe radius: 0 looks in the query's own bucket of every table, r also in every bucket
+        # up to r bits away. None scores the whole catalog, exact search like KDTreeIndex
+        vector = self.prepare(np.asarray(vector, dtype=np.float64)[None, :], self.center)[0]
+        if effort is None:
+            candidates = np.arange(self.size)
+        else:
+            picked = np.zeros(self.size, dtype=bool)  # rows found by several tables count once
+            for table in range(len(self.buckets)):
+                self.probe(table, int(self.codes(vector[None, :], table)[0]), effort, picked)
+            candidates = np.flatnonzero(picked)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        # rerank the candidates exactly
+        norms = self.norms[candidates] * np.linalg.norm(vector)
+        dot = self.vectors[candidates] @ vector
+        scores = np.divide(dot, norms, out=np.zeros_like(dot), where=norms != 0)
+        best = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return candidates[best], scores[best]
+
+    def save(self, path):
+        save_arrays(path, vectors=self.vectors, planes=self.planes, center=self.center)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        index = cls.__new__(cls)
+        index.center = bool(arrays["center"])
+        index.vectors = arrays["vectors"]
+        index.planes = arrays["planes"]
+        index.build_tables()
+        return index
+
+
+INDEX_TYPES = {
+    "euclidean": lambda vectors: KDTreeIndex(vectors, p=2),
+    "manhattan": lambda vectors: KDTreeIndex(vectors, p=1),
+    "cosine": lambda vectors: RandomProjectionIndex(vectors),
+    "pearson": lambda vectors: RandomProjectionIndex(vectors, center=True),
+}
+
+
+def load_index(path, metric):
+    return (RandomProjectionIndex if metric in ("cosine", "pearson") else KDTreeIndex).load(path)
+
+
+def benchmark_recall(recommender, k=10, queries=200, efforts=(1, 4, 16, None), metric="euclidean",
+                     kind="track", normalize=True, seed=0):
+    # recall@k and latency of the approximate index against exact search, one row per effort setting
+    labels = recommender.labels(kind)
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(labels), size=min(queries, len(labels)), replace=False)
+    query_ids = [labels[position] for position in picked.tolist()]
+    start = time.perf_counter()
+    exact = recommender.most_similar(query_ids, k, metric, normalize, kind)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(query_ids)
+    report = []
+    for effort in efforts:
+        start = time.perf_counter()
+        approximate = [recommender.most_similar(query_id, k, metric, normalize, kind, exact=False, effort=effort)
+                       for query_id in query_ids]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(query_ids)
+        hits = sum(len({label for label, _ in found} & {label for label, _ in truth})
+                   for found, truth in zip(approximate, exact))
+        report.append({"effort": effort, "recall": hits / max(1, sum(len(truth) for truth in exact)),
+                       "ms_per_query": elapsed_ms, "exact_ms_per_query": exact_ms})
+    return report
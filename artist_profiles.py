@@ -0,0 +1,120 @@
+import numpy as np
+
+from feature_store import FEATURE_NAMES
+
+
+def group_moments(values, weights, groups, group_count):
+    # weighted total, mean and sum of squared deviations of every group in a few vectorized passes
+    totals = np.bincount(groups, weights=weights, minlength=group_count)
+    means = np.zeros((group_count, values.shape[1]))
+    m2 = np.zeros((group_count, values.shape[1]))
+    for column in range(values.shape[1]):
+        sums = np.bincount(groups, weights=values[:, column] * weights, minlength=group_count)
+        np.divide(sums, totals, out=means[:, column], where=totals > 0)
+        deviations = values[:, column] - means[groups, column]
+        m2[:, column] = np.bincount(groups, weights=deviations * deviations * weights, minlength=group_count)
+    return totals, means, m2
+
+
+class ArtistProfiles:  # per artist track count, mean and variance of every feature, optionally popularity weighted
+    def __init__(self, names, feature_names=FEATURE_NAMES, weighted=False):
+        self.names = list(names)
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        self.feature_names = tuple(feature_names)
+        self.weighted = weighted  # weight every track by popularity + 1, so unpopular tracks still count a little
+        self.counts = np.zeros(len(self.names), dtype=np.int64)
+        self.totals = np.zeros(len(self.names))  # sum of weights, equal to counts when not weighted
+        self.means = np.zeros((len(self.names), len(self.feature_names)))
+        self.m2 = np.zeros((len(self.names), len(self.feature_names)))
+
+    @classmethod
+    def from_store(cls, store, weighted=False):
+        # one grouped pass over the artist -> rows table, no python loop per artist
+        return cls.from_entry_table(store.artists, np.asarray(store.matrix, dtype=np.float64)[store.artist_rows],
+                                    store.artist_offsets, store.feature_names, weighted)
+
+    @classmethod
+    def from_entry_table(cls, names, values, offsets, feature_names=FEATURE_NAMES, weighted=False):
+        # values[offsets[i]:offsets[i + 1]] are the tracks of the i-th artist of names (LazyArtistMusic.entry_table)
+        profiles = cls(names, feature_names, weighted)
+        counts = np.diff(offsets)
+        profiles.merge_groups(values, np.repeat(np.arange(len(counts)), counts))
+        return profiles
+
+    @classmethod
+    def from_artist_music(cls, artist_music, weighted=False):
+        # dict data: flatten once into a matrix and a group column, then aggregate the same way
+        names = list(artist_music)
+        values = []
+        groups = []
+        for position, name in enumerate(names):
+            for entry in artist_music[name]:
+                values.append([entry["features"][feature] for feature in FEATURE_NAMES])
+                groups.append(position)
+        profiles = cls(names, FEATURE_NAMES, weighted)
+        profiles.merge_groups(np.array(values, dtype=np.float64).reshape(len(values), len(FEATURE_NAMES)),
+                              np.array(groups, dtype=np.int64))
+        return profiles
+
+    def track_weights(self, values):
+        if not self.weighted:
+            return np.ones(values.shape[0])
+        return values[:, self.feature_names.index("popularity")] + 1.0
+
+    def merge_groups(self, values, groups):
+        # fold new tracks into the profiles they belong to with the parallel (Chan) merge of weighted moments,
+        # only the artists that appear in groups are touched
+        if not len(groups):
+            return
+        touched, local = np.unique(groups, return_inverse=True)
+        weights = self.track_weights(values)
+        totals, means, m2 = group_moments(values, weights, local, len(touched))
+        old_totals = self.totals[touched]
+        combined = old_totals + totals
+        safe = np.where(combined > 0, combined, 1.0)[:, None]
+        delta = means - self.means[touched]
+        self.means[touched] += delta * (totals[:, None] / safe)
+        self.m2[touched] += m2 + delta * delta * (old_totals * totals)[:, None] / safe
+        self.totals[touched] = combined
+        self.counts[touched] += np.bincount(local, minlength=len(touched))
+
+    def add_tracks(self, artists_per_track, values):
+        # incremental update: artists_per_track is one list of artist names per new track, values its features
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.feature_names))
+        new_names = [name for artists in artists_per_track for name in artists if name not in self.positions]
+        for name in dict.fromkeys(new_names):
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+        extra = len(self.names) - len(self.counts)
+        if extra:
+            self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+            self.totals = np.concatenate([self.totals, np.zeros(extra)])
+            self.means = np.vstack([self.means, np.zeros((extra, len(self.feature_names)))])
+            self.m2 = np.vstack([self.m2, np.zeros((extra, len(self.feature_names)))])
+        rows = [row for row, artists in enumerate(artists_per_track) for _ in artists]
+        groups = [self.positions[name] for artists in artists_per_track for name in artists]
+        self.merge_groups(values[rows], np.array(groups, dtype=np.int64))
+
+    def variances(self):
+        return np.divide(self.m2, self.totals[:, None], out=np.zeros_like(self.m2), where=self.totals[:, None] > 0)
+
+    def features(self, name):
+        # the artist's mean features as a dict, what SimilarityMeasures compares
+        return dict(zip(self.feature_names, self.means[self.positions[name]].tolist()))
+
+    def profile(self, name):
+        position = self.positions[name]
+        return {
+            "count": int(self.counts[position]),
+            "mean": dict(zip(self.feature_names, self.means[position].tolist())),
+            "variance": dict(zip(self.feature_names, (self.m2[position] / max(self.totals[position], 1e-300)).tolist())),
+        }
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
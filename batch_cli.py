@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import sys
+import time
+from collections.abc import Mapping, Sequence
+from itertools import islice
+
+from load_data_set import MusicDataProcessor
+from result_cache import DEFAULT_ENTRIES
+from similarity_module import similarity_outcome
+
+# one JSON object per input line:
+#   {"kind": "artist" | "track", "id1": ..., "id2": ..., "metric": "cosine"}       similarity of a pair
+#   {"kind": "artist" | "track", "feature": "energy", "criterion": "highest"}   query_best_feature
+# and one JSON object per output line, in input order:
+#   {"line": n, "similarity": 0.93, "outcome": "Very Similar"} / {"line": n, "result": {...}} / {"line": n, "error": "..."}
+
+BATCH_LINES = 2000  # query lines handed to a worker at a time
+
+_processor = None  # loaded once in the parent, forked workers read it copy-on-write
+_normalize = True
+
+
+def prepare(processor, normalize):
+    # build every per-dataset structure the queries use before the pool forks, so workers only read them
+    processor.get_artist_profiles()
+    processor.get_feature_index("artist")
+    processor.get_feature_index("track")
+    if normalize:
+        processor.get_normalizer("artist")
+        processor.get_normalizer("track")
+
+
+def json_value(value):
+    # entries hold FeatureRow / GenreRefs views and numpy numbers, json gets plain dicts, lists and floats
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Sequence):
+        return list(value)
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def answer(processor, query, normalize):
+    kind = query.get("kind", "track")
+    if kind not in ("artist", "track"):
+        raise ValueError(f"Unknown kind {kind}, use artist or track.")
+    # both go through the processor's result cache, a repeated query (or a pair asked the other way round) is a lookup
+    if "feature" in query:
+        criterion = query.get("criterion", "highest").lower()
+        return {"result": processor.query_best_feature(kind, query["feature"], criterion)}
+    metric = query.get("metric", "euclidean").lower()
+    similarity = processor.query_similarity(kind, query["id1"], query["id2"], metric, normalize)
+    return {"similarity": similarity, "outcome": similarity_outcome(similarity)}
+
+
+def run_batch(batch):
+    # (first line number, lines) -> (output lines, errors, cache hits, cache misses). bad queries give an error
+    # line instead of stopping the run. every worker has its own cache, the parent adds up the counts
+    first_line, lines = batch
+    before = _processor.result_cache.stats()
+    output = []
+    errors = 0
+    for line_number, line in enumerate(lines, first_line):
+        try:
+            result = answer(_processor, json.loads(line), _normalize)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+            errors += 1
+        output.append(json.dumps({"line": line_number, **result}, default=json_value))
+    after = _processor.result_cache.stats()
+    return output, errors, after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+
+def read_batches(lines, batch_lines):
+    line_number = 1
+    lines = (line for line in lines if line.strip())
+    while True:
+        batch = list(islice(lines, batch_lines))
+        if not batch:
+            return
+        yield line_number, batch
+        line_number += len(batch)
+
+
+def main(argv=None):
+    global _processor, _normalize
+    parser = argparse.ArgumentParser(description="Answer similarity and feature queries from a JSONL stream.")
+    parser.add_argument("queries", nargs="?", default="-", help="JSONL file with one query per line, - for stdin")
+    parser.add_argument("--data", default="dataset/data.csv")
+    parser.add_argument("--genres", default="dataset/data_genres.csv")
+    parser.add_argument("--output", default="-", help="where the JSONL results go, - for stdout")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--batch-lines", type=int, default=BATCH_LINES)
+    parser.add_argument("--raw", action="store_true", help="compare raw features instead of z-scored ones")
+    parser.add_argument("--no-cache", action="store_true", help="parse the csv even when a snapshot exists")
+    parser.add_argument("--result-cache", type=int, default=DEFAULT_ENTRIES,
+                        help="answers kept for repeated queries, per worker, 0 turns it off")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    _processor = MusicDataProcessor(args.data, args.genres, columnar=True, use_cache=not args.no_cache,
+                                    result_cache_entries=args.result_cache)
+    with contextlib.redirect_stdout(sys.stderr):  # skipped row messages must not end up in the JSONL output
+        _processor.load_data()
+    _normalize = not args.raw
+    prepare(_processor, _normalize)
+    loaded = time.perf_counter()
+    print(f"loaded {len(_processor.get_feature_store())} tracks in {loaded - start:.2f}s", file=sys.stderr)
+
+    source = sys.stdin if args.queries == "-" else open(args.queries, "r", encoding="utf-8")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    count = errors = hits = misses = 0
+    try:
+        batches = read_batches(source, args.batch_lines)
+        # fork shares the loaded data with the workers without pickling it. where fork is not available
+        # (windows) or one worker is asked for, everything runs in this process
+        use_pool = args.workers > 1 and "fork" in multiprocessing.get_all_start_methods()
+        pool = multiprocessing.get_context("fork").Pool(args.workers) if use_pool else None
+        try:
+            results = pool.imap(run_batch, batches) if pool is not None else map(run_batch, batches)
+            for output, batch_errors, batch_hits, batch_misses in results:  # imap hands batches back in input order while later ones still run
+                target.write("\n".join(output) + "\n")
+                count += len(output)
+                errors += batch_errors
+                hits += batch_hits
+                misses += batch_misses
+        finally:
+            if pool is not None:
+                pool.terminate()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    elapsed = time.perf_counter() - loaded
+    print(f"{count} queries ({errors} errors) in {elapsed:.2f}s, {count / elapsed if elapsed > 0 else 0:.0f} queries/sec",
+          file=sys.stderr)
+    print(f"result cache: {hits} hits, {misses} misses, hit rate {hits / (hits + misses) if hits + misses else 0:.1%}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from generate_dataset import ensure_dataset, parse_size
+from instrumentation import peak_rss_mb
+
+# times every stage of the pipeline on generated datasets and writes a JSON report. each (size, mode) runs in its
+# own process so peak RSS belongs to that run alone. compare two reports with --compare to catch regressions:
+#   python benchmark.py 10k 100k 1m --output bench_report.json
+#   python benchmark.py 10k 100k 1m --output new.json --compare bench_report.json
+#   python benchmark.py 1m --modes sharded --workers 1,2,4,8     columnar load time by number of parsing processes
+
+MODES = ("dict", "columnar", "snapshot")
+WORKERS = "1,2,4"  # process counts the sharded mode is run with
+DICT_LIMIT = 1000000  # dict mode keeps a python dict per track, above this it needs more memory than most machines have
+SIMILARITY_PAIRS = 20000
+FEATURE_QUERIES = 200
+TOP_K_QUERIES = 20
+RECALL_QUERIES = 100
+# effort settings of the recall@10 stages: leaves scanned by the kd-tree, multi-probe radius of the lsh index.
+# None is exact search in both
+RECALL_EFFORTS = {"euclidean": (1, 4, 16, 64, None), "cosine": (0, 1, 2, 3, None)}
+
+
+class StageTimer:  # collects {stage: {"seconds", "peak_rss_mb", ...}} for one run
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, **extra):
+        start = time.perf_counter()
+        record = dict(extra)
+        yield record
+        record["seconds"] = time.perf_counter() - start
+        record["peak_rss_mb"] = peak_rss_mb()
+        self.stages[name] = record
+
+
+def run_stages(mode, data_path, genre_path, seed=0, workers=1):
+    # imports are here so the parent process that only spawns workers stays small
+    from ann_index import benchmark_recall
+    from load_data_set import MusicDataProcessor
+    from similarity_module import SimilarityMeasures
+    from statistical_functions import FeatureStatistics
+
+    timer = StageTimer()
+    rng = random.Random(seed)
+    if mode == "snapshot":
+        shutil.rmtree(data_path + ".snapshot", ignore_errors=True)
+        with timer.stage("load_cold") as record:  # parse the csv and write the snapshot
+            processor = MusicDataProcessor(data_path, genre_path, use_cache=True)
+            processor.load_data()
+            record["rows"] = processor.load_report["rows"]
+        with timer.stage("load_warm") as record:  # memory map the snapshot
+            processor = MusicDataProcessor(data_path, genre_path, use_cache=True)
+            processor.load_data()
+            record["source"] = processor.load_report["source"]
+        shutil.rmtree(data_path + ".snapshot", ignore_errors=True)
+        return timer.stages
+    if mode == "sharded":  # only the load, the store it builds is the same for every worker count
+        with timer.stage("load", workers=workers) as record:
+            processor = MusicDataProcessor(data_path, genre_path, columnar=True, workers=workers)
+            processor.load_data()
+            record.update(rows=processor.load_report["rows"], rows_per_sec=processor.load_report["rows_per_sec"])
+        return timer.stages
+
+    with timer.stage("load") as record:
+        processor = MusicDataProcessor(data_path, genre_path, columnar=mode == "columnar")
+        processor.load_data()
+        record.update(rows=processor.load_report["rows"], skipped=processor.load_report["skipped"],
+                      rows_per_sec=processor.load_report["rows_per_sec"])
+    artist_music = processor.get_artist_music()
+    music_features = processor.get_music_features()
+
+    with timer.stage("calculate_statistics"):
+        FeatureStatistics(artist_music).calculate_statistics()
+    with timer.stage("calculate_statistics_tracks"):  # genre entries of every track, shared ones read once
+        FeatureStatistics(music_features).calculate_statistics()
+    with timer.stage("query_best_feature_scan"):  # the original full scan, one query
+        FeatureStatistics(artist_music).query_best_feature("energy", "highest")
+    with timer.stage("feature_index_build"):
+        processor.get_feature_index("artist")
+        processor.get_feature_index("track")
+    features = ("valence", "energy", "danceability", "loudness", "tempo", "popularity")
+    with timer.stage("query_best_feature_indexed", queries=FEATURE_QUERIES) as record:
+        for number in range(FEATURE_QUERIES):
+            processor.get_feature_index(("artist", "track")[number % 2]).query_best_feature(
+                features[number % len(features)], ("highest", "lowest")[number // 2 % 2])
+    with timer.stage("profiles_and_normalizers"):
+        processor.get_artist_profiles()
+        processor.get_normalizer("artist")
+        processor.get_normalizer("track")
+
+    track_ids = list(music_features)
+    artists = list(processor.get_artist_profiles())
+    pairs = [(rng.choice(track_ids), rng.choice(track_ids)) for _ in range(SIMILARITY_PAIRS // 2)]
+    artist_pairs = [(rng.choice(artists), rng.choice(artists)) for _ in range(SIMILARITY_PAIRS // 2)]
+    with timer.stage("compute_similarity", pairs=SIMILARITY_PAIRS) as record:
+        track_normalizer = processor.get_normalizer("track")
+        artist_normalizer = processor.get_normalizer("artist")
+        profiles = processor.get_artist_profiles()
+        for first, second in pairs:
+            SimilarityMeasures.compute_similarity(music_features, first, second,
+                                                  SimilarityMeasures.cosine_similarity, normalizer=track_normalizer)
+        for first, second in artist_pairs:
+            SimilarityMeasures.compute_similarity(profiles, first, second,
+                                                  SimilarityMeasures.euclidean_similarity, normalizer=artist_normalizer)
+    record["us_per_pair"] = record["seconds"] / SIMILARITY_PAIRS * 1e6
+
+    if mode == "columnar":
+        recommender = processor.get_recommender()
+        store = processor.get_feature_store()
+        queries = [store.ids[rng.randrange(len(store))] for _ in range(TOP_K_QUERIES)]
+        with timer.stage("top_k_exact", queries=TOP_K_QUERIES) as record:
+            recommender.most_similar(queries, 10, "euclidean")
+        record["ms_per_query"] = record["seconds"] / TOP_K_QUERIES * 1000
+        for metric, efforts in RECALL_EFFORTS.items():
+            with timer.stage(f"ann_build_{metric}"):
+                recommender.build_index("track", metric)
+            with timer.stage(f"ann_recall_{metric}", queries=RECALL_QUERIES) as record:  # recall@10 and ms per effort
+                record["efforts"] = benchmark_recall(recommender, 10, RECALL_QUERIES, efforts, metric, seed=seed)
+    return timer.stages
+
+
+def run_worker(mode, data_path, genre_path, seed, workers=1):
+    # stage output (skipped row messages) goes to stderr, stdout carries only the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        stages = run_stages(mode, data_path, genre_path, seed, workers)
+    print(json.dumps(stages))
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def add_scaling(runs):
+    # load speedup of every sharded-N run over sharded-1, stored next to the runs
+    single = runs.get("sharded-1", {}).get("load")
+    if not isinstance(single, dict):
+        return
+    for name, stages in runs.items():
+        load = stages.get("load") if name.startswith("sharded-") else None
+        if isinstance(load, dict) and load["seconds"]:
+            load["speedup"] = single["seconds"] / load["seconds"]
+
+
+def compare(report, baseline, tolerance, min_seconds=0.05):
+    # stage by stage time ratio against an older report, returns the stages that got slower than tolerance allows.
+    # stages shorter than min_seconds in both reports are mostly timer noise and never flagged
+    regressions = []
+    for size, modes in report["runs"].items():
+        for mode, stages in modes.items():
+            old_stages = baseline.get("runs", {}).get(size, {}).get(mode, {})
+            for stage, numbers in stages.items():
+                old = old_stages.get(stage)
+                if not isinstance(numbers, dict) or not isinstance(old, dict) or not old.get("seconds"):
+                    continue
+                ratio = numbers["seconds"] / old["seconds"]
+                slow = ratio > tolerance and max(old["seconds"], numbers["seconds"]) >= min_seconds
+                flag = "REGRESSION" if slow else ""
+                print(f"{size:>8} {mode:<9} {stage:<28} {old['seconds']:9.3f}s -> {numbers['seconds']:9.3f}s "
+                      f"x{ratio:5.2f} {flag}")
+                if flag:
+                    regressions.append((size, mode, stage, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading, statistics, queries and similarity.")
+    parser.add_argument("sizes", nargs="*", default=["10k", "100k"], help="rows, e.g. 10k 100k 1m 5m")
+    parser.add_argument("--modes", default=",".join(MODES), help="dict, columnar, snapshot and/or sharded")
+    parser.add_argument("--workers", default=WORKERS, help="process counts for the sharded mode, e.g. 1,2,4,8")
+    parser.add_argument("--folder", default="bench_data", help="where generated datasets are kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dict-limit", type=int, default=DICT_LIMIT, help="largest size dict mode is run at")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", help="older report to compare stage times against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="shorter stages are not flagged")
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "DATA", "GENRES"), help=argparse.SUPPRESS)
+    parser.add_argument("--worker-processes", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(*args.worker, args.seed, args.worker_processes)
+        return
+
+    report = {"meta": metadata(), "runs": {}}
+    for size in args.sizes:
+        rows = parse_size(size)
+        start = time.perf_counter()
+        data_path, genre_path = ensure_dataset(args.folder, rows, args.seed)
+        print(f"{rows} rows: dataset ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        runs = report["runs"][str(rows)] = {}
+        jobs = []  # (run name, mode, workers)
+        for mode in args.modes.split(","):
+            if mode == "sharded":
+                jobs.extend((f"sharded-{workers}", mode, int(workers)) for workers in args.workers.split(","))
+            else:
+                jobs.append((mode, mode, 1))
+        for name, mode, workers in jobs:
+            if mode == "dict" and rows > args.dict_limit:
+                runs[name] = {"skipped": f"more than --dict-limit {args.dict_limit} rows"}
+                continue
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--seed", str(args.seed),
+                                     "--worker-processes", str(workers), "--worker", mode, data_path, genre_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            if result.returncode != 0:
+                runs[name] = {"failed": f"exit code {result.returncode}"}  # e.g. killed for running out of memory
+            else:
+                runs[name] = json.loads(result.stdout)
+            for stage, numbers in runs[name].items():
+                if isinstance(numbers, dict):
+                    print(f"{rows:>8} {name:<9} {stage:<28} {numbers['seconds']:9.3f}s "
+                          f"peak {numbers['peak_rss_mb'] or 0:8.1f} MB", file=sys.stderr)
+                else:
+                    print(f"{rows:>8} {name:<9} {stage}: {numbers}", file=sys.stderr)
+        add_scaling(runs)
+        for name, stages in runs.items():
+            if "speedup" in stages.get("load", {}):
+                print(f"{rows:>8} {name:<9} load speedup x{stages['load']['speedup']:.2f} "
+                      f"(cpu_count {os.cpu_count()})", file=sys.stderr)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, sort_keys=True)  # sorted and indented so two reports diff line by line
+    print(f"report written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.tolerance, args.min_seconds)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
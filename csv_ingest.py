@@ -0,0 +1,160 @@
+import io
+import os
+from itertools import islice
+
+from feature_store import FEATURE_NAMES, INTEGER_FEATURES
+
+BLOCK_BYTES = 16 << 20  # bytes decoded at a time when reading a byte range of the file
+MUSIC_COLUMNS = ("artists", "name", "id", "key") + FEATURE_NAMES  # columns load_music_data needs from data.csv
+OPTIONAL_COLUMNS = ("genres",)  # read when present, e.g. exports that list each track's genres
+
+
+def split_line(line):
+    # gives the same fields as walking the line one character at a time and toggling on every ",
+    # but lets str.split do the scanning. after splitting on " the even parts are outside quotes
+    # (their commas separate values) and the odd parts are inside quotes (their commas are data)
+    if '"' not in line:
+        return [value.strip() for value in line.split(",")]
+    fields = []
+    current = []
+    for index, part in enumerate(line.split('"')):
+        if index % 2:
+            current.append(part)
+            continue
+        pieces = part.split(",")
+        current.append(pieces[0])
+        if len(pieces) > 1:
+            fields.append("".join(current).strip())
+            fields.extend(piece.strip() for piece in pieces[1:-1])
+            current = [pieces[-1]]
+    fields.append("".join(current).strip())
+    return fields
+
+
+def split_artists(raw_artists):
+    # "['A', 'B']" -> ["A", "B"], same cleanup load_music_data always did on the artists column
+    return [artist.strip("'\" ").strip() for artist in raw_artists.strip('[]"').split("', '")]
+
+
+def split_genres(raw_genres):
+    # genres use the same list format as artists, "[]" means the track has no genre
+    return [genre for genre in split_artists(raw_genres) if genre]
+
+
+def read_lines(path, start, end, block_bytes=BLOCK_BYTES):
+    # the text lines of the byte range start:end, start being right after a newline. blocks are extended to the
+    # next newline and decoded with the same universal newline handling as reading the file in text mode
+    with open(path, "rb") as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            block = file.read(min(block_bytes, end - position))
+            if not block:
+                break
+            if position + len(block) < end:
+                block += file.readline()
+            position += len(block)
+            yield from io.TextIOWrapper(io.BytesIO(block), encoding="utf-8", newline=None)
+
+
+def complete_lines_end(path, start=0, block_bytes=1 << 16):
+    # offset right after the last newline at or after start, start when there is none: a line still being
+    # appended is left for later
+    position = os.path.getsize(path)
+    with open(path, "rb") as file:
+        while position > start:
+            block_start = max(start, position - block_bytes)
+            file.seek(block_start)
+            found = file.read(position - block_start).rfind(b"\n")
+            if found >= 0:
+                return block_start + found + 1
+            position = block_start
+    return start
+
+
+class MusicChunk:  # a block of parsed rows stored column by column
+    def __init__(self, ids, names, keys, artists, columns, genres=None):
+        self.ids = ids
+        self.names = names
+        self.keys = keys
+        self.artists = artists  # list of artist names per row
+        self.columns = columns  # one list of numbers per feature, in FEATURE_NAMES order
+        self.genres = genres  # list of genre names per row, None when data.csv has no genres column
+        self.genre_refs = None  # GenreRefs per row, filled in by the loader once genres are resolved
+        self.positions = None  # index in the block of lines of every row, None when no line was skipped
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class MusicCsvReader:  # reads data.csv in blocks of lines and converts the numbers one column at a time
+    def __init__(self, file_path, chunk_rows=50000):
+        self.file_path = file_path
+        self.chunk_rows = chunk_rows
+        self.rows_parsed = 0  # rows that made it into a chunk
+        self.rows_skipped = 0  # rows dropped because a feature was not a number
+        self.skipped_ids = []  # track ids of those rows
+        self.bytes_read = 0  # characters consumed so far, the same as bytes for ascii data. drives progress bars
+
+    def read_header(self, file):
+        header = file.readline().strip().split(",")
+        columns = {column: header.index(column) for column in MUSIC_COLUMNS}
+        columns.update({column: header.index(column) for column in OPTIONAL_COLUMNS if column in header})
+        return columns
+
+    def chunks(self, start=None, end=None):
+        # the whole file, or with start/end only the lines in that byte range (start right after a newline)
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            columns = self.read_header(file)
+            source = file if start is None else read_lines(self.file_path, start, end)
+            while True:
+                lines = list(islice(source, self.chunk_rows))
+                if not lines:
+                    break
+                self.bytes_read += sum(map(len, lines))
+                chunk = self.parse_lines(lines, columns)
+                self.rows_parsed += len(chunk)
+                yield chunk
+
+    def parse_lines(self, lines, columns):
+        rows = [split_line(line) for line in lines]
+        positions = None
+        try:
+            converted = [
+                list(map(int if feature in INTEGER_FEATURES else float, [row[columns[feature]] for row in rows]))
+                for feature in FEATURE_NAMES
+            ]
+        except ValueError:
+            # some row in this block is bad, redo it row by row so only that row is dropped
+            rows, converted, positions = self.convert_rows(rows, columns)
+        chunk = MusicChunk(
+            ids=[row[columns["id"]] for row in rows],
+            names=[row[columns["name"]] for row in rows],
+            keys=[row[columns["key"]] for row in rows],
+            artists=[split_artists(row[columns["artists"]]) for row in rows],
+            columns=converted,
+            genres=[split_genres(row[columns["genres"]]) for row in rows] if "genres" in columns else None,
+        )
+        chunk.positions = positions
+        return chunk
+
+    def convert_rows(self, rows, columns):
+        kept = []
+        positions = []
+        values = []
+        for position, row in enumerate(rows):
+            try:
+                values.append([
+                    int(row[columns[feature]]) if feature in INTEGER_FEATURES else float(row[columns[feature]])
+                    for feature in FEATURE_NAMES
+                ])
+            except ValueError as e:
+                # Skip rows with invalid numeric data
+                print(f"Error parsing features for track ID {row[columns['id']]}: {e}")
+                self.rows_skipped += 1
+                self.skipped_ids.append(row[columns["id"]])
+                continue
+            kept.append(row)
+            positions.append(position)
+        converted = [list(column) for column in zip(*values)] if values else [[] for _ in FEATURE_NAMES]
+        return kept, converted, positions
@@ -0,0 +1,247 @@
+import numpy as np
+
+from feature_store import ArtistMusicView, FEATURE_NAMES, FeatureRow
+from genre_table import SharedGroups
+from lazy_store import LazyArtistMusic
+
+
+class FeatureIndex:  # sorted order of every feature over the (key, entry) pairs of artist_music or music_features
+    def __init__(self, data):
+        # entries that are shared by several keys (tracks of one key share their GenreRefs) are stored once,
+        # together with the keys that hold them, so the index stays as small as the distinct data
+        self.data = data
+        self.keys = list(data)
+        self.key_positions = None  # key -> position in keys, made when update() first needs it
+        self.view = data if isinstance(data, ArtistMusicView) else None
+        self.entry_lines = None  # line offset of every entry in data.csv, lazy mode only
+        if self.view is not None:
+            self.build_from_store(self.view.store)
+        elif isinstance(data, LazyArtistMusic):
+            self.build_from_lines(data)
+        else:
+            self.build_from_entries(data)
+        self.group_sizes = np.bincount(self.entry_group, minlength=len(self.group_keys or self.keys)).tolist()
+        order = np.stack([self.entry_group_first, self.entry_position])
+        self.sorted_rows = {}  # feature -> entry rows sorted by value, ties in the order a scan meets them
+        self.sorted_values = {}
+        self.valid = {}  # feature -> how many entries have the feature (missing ones sort last as nan)
+        self.highest_at = {}  # feature -> position in sorted_rows of the first entry holding the max value
+        for column, feature in enumerate(self.feature_names):
+            values = self.values[:, column]
+            rows = np.lexsort((order[1], order[0], values))
+            sorted_values = values[rows]
+            valid = int(np.count_nonzero(~np.isnan(sorted_values)))
+            self.sorted_rows[feature] = rows
+            self.sorted_values[feature] = sorted_values
+            self.valid[feature] = valid
+            if valid:
+                self.highest_at[feature] = int(np.searchsorted(sorted_values[:valid], sorted_values[valid - 1], "left"))
+
+    def build_from_store(self, store):
+        # one entry per artist track, values come straight from the matrix
+        self.feature_names = store.feature_names
+        self.store = store
+        counts = np.diff(store.artist_offsets)
+        self.values = np.asarray(store.matrix, dtype=np.float64)[store.artist_rows]
+        self.entry_rows = store.artist_rows
+        self.entry_group = np.repeat(np.arange(len(counts)), counts)
+        self.entry_group_first = self.entry_group  # every artist is its own group
+        self.entry_position = np.arange(len(self.entry_rows)) - np.repeat(store.artist_offsets[:-1], counts)
+        self.group_keys = None
+
+    def build_from_lines(self, data):
+        # lazy mode: only the numbers are kept, an entry is read from data.csv again when a query returns it
+        self.feature_names = FEATURE_NAMES
+        self.catalog = data.catalog
+        self.values, offsets, self.entry_lines = data.entry_table()
+        counts = np.diff(offsets)
+        self.entry_group = np.repeat(np.arange(len(counts)), counts)
+        self.entry_group_first = self.entry_group  # every artist is its own group
+        self.entry_position = np.arange(len(self.values)) - np.repeat(offsets[:-1], counts)
+        self.group_keys = None
+
+    def build_from_entries(self, data):
+        self.groups = SharedGroups.of(data)  # the same list object under several keys is one group
+        feature_names = []
+        entries = []
+        entry_group = []
+        entry_position = []
+        for group, items in enumerate(self.groups.items):
+            for position, entry in enumerate(items):
+                for feature in entry["features"]:
+                    if feature not in feature_names:
+                        feature_names.append(feature)
+                entries.append(entry)
+                entry_group.append(group)
+                entry_position.append(position)
+        self.feature_names = tuple(feature_names)
+        self.values = np.array(
+            [[entry["features"].get(feature, np.nan) for feature in feature_names] for entry in entries],
+            dtype=np.float64).reshape(len(entries), len(feature_names))
+        self.entries = entries
+        self.group_keys = group_keys = self.groups.key_positions
+        self.entry_group = np.array(entry_group, dtype=np.int64)
+        self.entry_group_first = np.array([keys[0] for keys in group_keys], dtype=np.int64)[self.entry_group] \
+            if entries else np.empty(0, dtype=np.int64)
+        self.entry_position = np.array(entry_position, dtype=np.int64)
+
+    def update(self, keys):
+        # fold in the entries keys gained since the index was built: keys that are new, or whose list of entries
+        # only grew at the end. returns False for anything else (a key now holding a different list), the caller
+        # then builds a new index. the result equals a new index over the updated data
+        if self.entry_lines is not None:
+            return False  # lazy data is loaded again, never updated
+        if self.key_positions is None:
+            self.key_positions = {key: position for position, key in enumerate(self.keys)}
+        values, groups, firsts, positions, entry_rows = [], [], [], [], []
+        for key in keys:
+            key_position = self.key_positions.get(key)
+            new_key = key_position is None
+            if new_key:
+                key_position = self.key_positions[key] = len(self.keys)
+                self.keys.append(key)
+            if self.view is not None:
+                store = self.store = self.view.store
+                group = key_position  # every artist is its own group, numbered like the store's artist codes
+                if group == len(self.group_sizes):
+                    self.group_sizes.append(0)
+                rows = store.rows_of_artist(key)[self.group_sizes[group]:]
+                values.append(np.asarray(store.matrix[rows], dtype=np.float64))
+                entry_rows.append(rows)
+                first = group
+                count = len(rows)
+            else:
+                items = self.data[key]
+                group = self.groups.find(items)
+                if group is None and not new_key:
+                    return False  # an old key that holds a different object now
+                if new_key:  # a new list, or one shared with old keys
+                    group = self.groups.add(items, key_position)
+                    if group == len(self.group_sizes):
+                        self.group_sizes.append(0)
+                new_entries = list(items)[self.group_sizes[group]:]
+                values.append(np.array([[entry["features"].get(feature, np.nan) for feature in self.feature_names]
+                                        for entry in new_entries], dtype=np.float64).reshape(-1, len(self.feature_names)))
+                self.entries.extend(new_entries)
+                first = int(self.group_keys[group][0])
+                count = len(new_entries)
+            groups.append(np.full(count, group, dtype=np.int64))
+            firsts.append(np.full(count, first, dtype=np.int64))
+            positions.append(np.arange(self.group_sizes[group], self.group_sizes[group] + count))
+            self.group_sizes[group] += count
+        if values:
+            self.insert(np.concatenate(values), np.concatenate(groups), np.concatenate(firsts),
+                        np.concatenate(positions), np.concatenate(entry_rows) if entry_rows else None)
+        return True
+
+    def insert(self, values, groups, firsts, positions, entry_rows=None):
+        # new entry rows merged into every feature's sorted order with the tie rule of the full build
+        # (value, then first key position, then position in the list) instead of sorting everything again
+        start = len(self.values)
+        self.values = np.concatenate([self.values, values])
+        self.entry_group = np.concatenate([self.entry_group, groups])
+        self.entry_position = np.concatenate([self.entry_position, positions])
+        if entry_rows is not None:
+            self.entry_rows = np.concatenate([self.entry_rows, entry_rows])
+        self.entry_group_first = self.entry_group if self.view is not None else \
+            np.concatenate([self.entry_group_first, firsts])
+        ties = (self.entry_group_first.astype(np.int64) << 32) | self.entry_position  # both below 2**31
+        new_rows = np.arange(start, start + len(values))
+        for column, feature in enumerate(self.feature_names):
+            new_values = values[:, column]
+            order = np.lexsort((positions, firsts, new_values))
+            rows = new_rows[order]
+            new_values = new_values[order]
+            old_rows = self.sorted_rows[feature]
+            old_values = self.sorted_values[feature]
+            places = np.searchsorted(old_values, new_values, "left")  # nan sorts last here as well
+            ends = np.searchsorted(old_values, new_values, "right")
+            tied = np.flatnonzero(ends > places).tolist()
+            if tied:
+                old_ties = ties[old_rows]
+                for i in tied:
+                    places[i] += np.searchsorted(old_ties[places[i]:ends[i]], ties[rows[i]])
+            sorted_values = self.sorted_values[feature] = np.insert(old_values, places, new_values)
+            self.sorted_rows[feature] = np.insert(old_rows, places, rows)
+            valid = self.valid[feature] = self.valid[feature] + int(np.count_nonzero(~np.isnan(new_values)))
+            if valid:
+                self.highest_at[feature] = int(np.searchsorted(sorted_values[:valid], sorted_values[valid - 1], "left"))
+
+    def entry(self, row):
+        if self.view is not None:
+            store = self.store
+            track = int(self.entry_rows[row])
+            return {"name": store.names[track], "id": store.ids[track], "features": FeatureRow(store, track)}
+        if self.entry_lines is not None:
+            line = self.catalog.row(int(self.entry_lines[row]))
+            return {"name": line.name, "id": line.track_id, "features": line.features}
+        return self.entries[row]
+
+    def occurrences(self, rows):
+        # (key position, position in the key's list, entry row) for every key that holds these entries, scan order
+        found = []
+        for row in rows:
+            group = int(self.entry_group[row])
+            position = int(self.entry_position[row])
+            if self.group_keys is None:
+                found.append((group, position, row))
+            else:
+                found.extend((key_position, position, row) for key_position in self.group_keys[group])
+        found.sort()
+        return found
+
+    def result(self, key_position, row):
+        return {"key": self.keys[key_position], "entry": self.entry(row)}
+
+    def query_best_feature(self, feature, criterion):
+        # same answer as FeatureStatistics.query_best_feature, without scanning the data
+        if feature not in self.sorted_rows or not self.valid[feature]:
+            return None
+        rows = self.sorted_rows[feature]
+        if criterion == "highest":
+            row = rows[self.highest_at[feature]]
+        elif criterion == "lowest":
+            row = rows[0]
+        else:
+            # the scan never replaces its first pick for any other criterion, that is the first entry met
+            valid_rows = rows[:self.valid[feature]]
+            row = valid_rows[np.lexsort((self.entry_position[valid_rows], self.entry_group_first[valid_rows]))[0]]
+        return self.result(int(self.entry_group_first[row]), int(row))
+
+    def top(self, feature, n, criterion="highest"):
+        # the n best (key, entry) pairs, equal values in scan order
+        if feature not in self.sorted_rows:
+            return []
+        rows = self.sorted_rows[feature][:self.valid[feature]]
+        values = self.sorted_values[feature][:self.valid[feature]]
+        results = []
+        end = len(rows)
+        start = 0
+        while len(results) < n and (end > 0 if criterion == "highest" else start < len(rows)):
+            # take one block of equal values at a time and expand it to every key holding those entries
+            if criterion == "highest":
+                block_start = int(np.searchsorted(values[:end], values[end - 1], "left"))
+                block = rows[block_start:end]
+                end = block_start
+            else:
+                block_end = int(np.searchsorted(values, values[start], "right"))
+                block = rows[start:block_end]
+                start = block_end
+            for key_position, _, row in self.occurrences(block.tolist()):
+                results.append(self.result(key_position, row))
+                if len(results) == n:
+                    break
+        return results
+
+    def between(self, feature, low, high):
+        # every (key, entry) with low <= value <= high, lowest value first
+        if feature not in self.sorted_rows:
+            return []
+        values = self.sorted_values[feature][:self.valid[feature]]
+        first = int(np.searchsorted(values, low, "left"))
+        last = int(np.searchsorted(values, high, "right"))
+        rows = self.sorted_rows[feature][first:last]
+        results = []
+        for block in np.split(rows, np.flatnonzero(np.diff(values[first:last])) + 1):  # one block per distinct value
+            results.extend(self.result(key_position, row) for key_position, _, row in self.occurrences(block.tolist()))
+        return results
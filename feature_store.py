@@ -0,0 +1,351 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from genre_table import GenreRefs
+
+# order of the columns in the feature matrix, same order load_music_data builds the features dict in
+FEATURE_NAMES = (
+    "valence",
+    "acousticness",
+    "danceability",
+    "energy",
+    "liveness",
+    "loudness",
+    "popularity",
+    "speechiness",
+    "tempo",
+)
+INTEGER_FEATURES = {"popularity"}  # features parsed with int() instead of float()
+
+
+class StringTable:  # compact table of strings stored as one utf-8 blob plus offsets instead of one python str per row
+    def __init__(self, blob, offsets):
+        self.blob = bytes(blob)  # all strings encoded and joined together
+        self.offsets = np.asarray(offsets, dtype=np.int64)  # string i is blob[offsets[i]:offsets[i + 1]]
+        self._lookup = None
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [value.encode("utf-8") for value in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def concat(cls, tables):
+        # one table holding the strings of several tables, in order
+        offsets = [np.zeros(1, dtype=np.int64)]
+        size = 0
+        for table in tables:
+            offsets.append(table.offsets[1:] - table.offsets[0] + size)
+            size += int(table.offsets[-1] - table.offsets[0])
+        blob = b"".join(table.blob[table.offsets[0]:table.offsets[-1]] for table in tables)
+        return cls(blob, np.concatenate(offsets))
+
+    def appended(self, strings):
+        # a new table with strings added at the end. a lookup already built moves to the new table and is
+        # extended instead of being built again, so the old table must not be looked up in afterwards
+        table = StringTable.concat([self, StringTable.from_strings(strings)])
+        if self._lookup is not None:
+            lookup, self._lookup = self._lookup, None
+            lookup.update((value, index) for index, value in enumerate(strings, len(self)))
+            table._lookup = lookup
+        return table
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self):
+        blob = self.blob
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield blob[start:end].decode("utf-8")
+
+    def lookup(self):
+        # string -> position, built once on first use. duplicates keep the last position like a dict overwrite would
+        if self._lookup is None:
+            self._lookup = {value: index for index, value in enumerate(self)}
+        return self._lookup
+
+
+class ColumnarFeatureStore:  # one row per track, one column per feature, artists stored as a CSR table of row indexes
+    def __init__(self, matrix, ids, names, keys, key_labels, artists, artist_offsets, artist_rows,
+                 feature_names=FEATURE_NAMES, genre_offsets=None, genre_ids=None):
+        self.matrix = matrix  # (tracks, features) float matrix
+        self.ids = ids  # StringTable of track ids
+        self.names = names  # StringTable of track names
+        self.keys = keys  # int16 code of the musical key per row, -1 when the key column was empty
+        self.key_labels = key_labels  # key code -> original key string from the csv
+        self.artists = artists  # StringTable of artist names in first seen order
+        self.artist_offsets = artist_offsets  # rows of artist a are artist_rows[artist_offsets[a]:artist_offsets[a + 1]]
+        self.artist_rows = artist_rows
+        self.genre_offsets = genre_offsets  # genre ids of row r are genre_ids[genre_offsets[r]:genre_offsets[r + 1]],
+        self.genre_ids = genre_ids  # both None when data.csv has no genres column and tracks join on key instead
+        self.feature_names = tuple(feature_names)
+        self.columns = {feature: index for index, feature in enumerate(self.feature_names)}
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def row_of(self, track_id):
+        return self.ids.lookup()[track_id]
+
+    def rows_of_artist(self, artist):
+        index = self.artists.lookup()[artist]
+        return self.artist_rows[self.artist_offsets[index]:self.artist_offsets[index + 1]]
+
+    def column(self, feature):
+        return self.matrix[:, self.columns[feature]]
+
+    def features(self, row):
+        return FeatureRow(self, row)
+
+
+class FeatureStoreBuilder:  # collects parsed chunks while the csv is read and packs them into a ColumnarFeatureStore
+    def __init__(self, dtype=np.float64, feature_names=FEATURE_NAMES):
+        self.dtype = dtype
+        self.feature_names = tuple(feature_names)
+        self.blocks = []  # one (rows, features) matrix per chunk
+        self.ids = []
+        self.names = []
+        self.keys = []
+        self.key_codes = {}
+        self.artist_codes = {}
+        self.pair_artists = []  # one (artist code, row) pair per artist credited on a track
+        self.pair_rows = []
+        self.genre_counts = None  # genres per row, only when the csv has a genres column
+        self.genre_ids = []
+
+    def add_chunk(self, chunk):
+        first_row = len(self.ids)
+        self.ids.extend(chunk.ids)
+        self.names.extend(chunk.names)
+        key_codes = self.key_codes
+        self.keys.extend(key_codes.setdefault(key, len(key_codes)) if key else -1 for key in chunk.keys)
+        self.blocks.append(np.array(chunk.columns, dtype=self.dtype).reshape(len(self.feature_names), -1).T)
+        artist_codes = self.artist_codes
+        for row, artists in enumerate(chunk.artists, first_row):
+            for artist in artists:
+                self.pair_artists.append(artist_codes.setdefault(artist, len(artist_codes)))
+                self.pair_rows.append(row)
+        if chunk.genre_refs is not None:
+            if self.genre_counts is None:
+                self.genre_counts = []
+            for refs in chunk.genre_refs:
+                ids = refs.ids if refs is not None else ()
+                self.genre_counts.append(len(ids))
+                self.genre_ids.extend(ids)
+
+    def build(self):
+        if self.blocks:
+            matrix = np.ascontiguousarray(np.concatenate(self.blocks))
+        else:
+            matrix = np.empty((0, len(self.feature_names)), dtype=self.dtype)
+        return pack_store(
+            matrix=matrix,
+            ids=StringTable.from_strings(self.ids),
+            names=StringTable.from_strings(self.names),
+            keys=np.array(self.keys, dtype=np.int16),
+            key_labels=list(self.key_codes),
+            artists=StringTable.from_strings(self.artist_codes),
+            pair_artists=np.array(self.pair_artists, dtype=np.int64),
+            pair_rows=np.array(self.pair_rows, dtype=np.int64),
+            feature_names=self.feature_names,
+            genre_counts=self.genre_counts,
+            genre_ids=self.genre_ids,
+        )
+
+
+def pack_store(matrix, ids, names, keys, key_labels, artists, pair_artists, pair_rows, feature_names=FEATURE_NAMES,
+               genre_counts=None, genre_ids=None):
+    # ColumnarFeatureStore from flat columns: one (artist code, row) pair per artist credit and, when the csv has
+    # genres, the number of genre ids per row followed by all genre ids in row order
+    order = np.argsort(pair_artists, kind="stable")  # stable so each artist keeps its tracks in file order
+    artist_offsets = np.zeros(len(artists) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_artists, minlength=len(artists)), out=artist_offsets[1:])
+    genre_offsets = None
+    if genre_counts is not None:
+        genre_offsets = np.zeros(len(genre_counts) + 1, dtype=np.int64)
+        np.cumsum(genre_counts, out=genre_offsets[1:])
+        genre_ids = np.asarray(genre_ids, dtype=np.int32)
+    else:
+        genre_ids = None
+    return ColumnarFeatureStore(
+        matrix=matrix,
+        ids=ids,
+        names=names,
+        keys=keys,
+        key_labels=key_labels,
+        artists=artists,
+        artist_offsets=artist_offsets,
+        artist_rows=np.asarray(pair_rows, dtype=np.int64)[order],
+        feature_names=feature_names,
+        genre_offsets=genre_offsets,
+        genre_ids=genre_ids,
+    )
+
+
+def genre_table_of(store):
+    # (genre_offsets, genre_ids) of a store, no genres on any row when it has none
+    if store.genre_offsets is not None:
+        return store.genre_offsets, store.genre_ids
+    return np.zeros(len(store) + 1, dtype=np.int64), np.zeros(0, dtype=np.int32)
+
+
+def extend_store(store, delta):
+    # store with the rows of delta (a store built from rows appended to the csv) after its own. the result is the
+    # store a full load of both would give: keys and artists keep their codes, new ones are added in first seen
+    # order and every artist's new rows go after its old ones. arrays are copied, so memory mapped ones are fine
+    row_offset = len(store)
+    key_codes = {label: code for code, label in enumerate(store.key_labels)}
+    key_map = np.array([key_codes.setdefault(label, len(key_codes)) for label in delta.key_labels] + [-1],
+                       dtype=np.int16)  # the extra -1 at the end maps "no key" to itself
+    lookup = store.artists.lookup()
+    new_artists = [artist for artist in dict.fromkeys(delta.artists) if artist not in lookup]
+    artists = store.artists.appended(new_artists)
+    lookup = artists.lookup()
+    artist_map = np.array([lookup[artist] for artist in delta.artists], dtype=np.int64)
+    pair_artists = np.repeat(artist_map, np.diff(delta.artist_offsets))
+    order = np.argsort(pair_artists, kind="stable")
+    pair_artists = pair_artists[order]
+    old_offsets = np.concatenate([store.artist_offsets, np.full(len(new_artists), store.artist_offsets[-1])])
+    # every new pair goes right after its artist's old rows, np.insert keeps pairs with the same place in order
+    artist_rows = np.insert(store.artist_rows, old_offsets[pair_artists + 1], delta.artist_rows[order] + row_offset)
+    artist_offsets = old_offsets.copy()
+    artist_offsets[1:] += np.cumsum(np.bincount(pair_artists, minlength=len(artists)))
+    genre_offsets = genre_ids = None
+    if store.genre_offsets is not None or delta.genre_offsets is not None:
+        # a store built from no rows at all cannot tell that the csv has a genres column, its rows have no genres
+        old_offsets, old_ids = genre_table_of(store)
+        new_offsets, new_ids = genre_table_of(delta)
+        genre_offsets = np.concatenate([old_offsets, new_offsets[1:] + old_offsets[-1]])
+        genre_ids = np.concatenate([old_ids, new_ids])
+    return ColumnarFeatureStore(
+        matrix=np.concatenate([store.matrix, delta.matrix.astype(store.matrix.dtype)]),
+        ids=store.ids.appended(list(delta.ids)),
+        names=StringTable.concat([store.names, delta.names]),
+        keys=np.concatenate([store.keys, key_map[delta.keys]]),
+        key_labels=list(key_codes),
+        artists=artists,
+        artist_offsets=artist_offsets,
+        artist_rows=artist_rows,
+        feature_names=store.feature_names,
+        genre_offsets=genre_offsets,
+        genre_ids=genre_ids,
+    )
+
+
+def store_from_artist_music(artist_music, feature_names=FEATURE_NAMES):
+    # ColumnarFeatureStore of the tracks in an artist -> entries dict, for code that needs a feature matrix when the
+    # data was loaded in dict or lazy mode. one row per track id, in the order artists first list them; a track id
+    # repeated in the csv keeps its first row. keys and genres are not in the entries, so the store has neither
+    rows = {}  # track id -> row
+    names, values, pair_artists, pair_rows = [], [], [], []
+    for code, (artist, entries) in enumerate(artist_music.items()):
+        for entry in entries:
+            row = rows.get(entry["id"])
+            if row is None:
+                row = rows[entry["id"]] = len(rows)
+                names.append(entry["name"])
+                features = entry["features"]
+                values.append([features[feature] for feature in feature_names])
+            pair_artists.append(code)
+            pair_rows.append(row)
+    return pack_store(
+        matrix=np.array(values, dtype=np.float64).reshape(len(values), len(feature_names)),
+        ids=StringTable.from_strings(rows),
+        names=StringTable.from_strings(names),
+        keys=np.full(len(rows), -1, dtype=np.int16),
+        key_labels=[],
+        artists=StringTable.from_strings(artist_music),
+        pair_artists=np.array(pair_artists, dtype=np.int64),
+        pair_rows=np.array(pair_rows, dtype=np.int64),
+        feature_names=feature_names,
+    )
+
+
+class FeatureRow(Mapping):  # read only dict-like view of one matrix row, what entry["features"] returns in columnar mode
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, feature):
+        value = self._store.matrix[self._row, self._store.columns[feature]].item()
+        return int(value) if feature in INTEGER_FEATURES else value
+
+    def __contains__(self, feature):
+        return feature in self._store.columns
+
+    def __iter__(self):
+        return iter(self._store.feature_names)
+
+    def __len__(self):
+        return len(self._store.feature_names)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ArtistMusicView(Mapping):  # artist -> list of {"name", "id", "features"} entries, built on access from the store
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, artist):
+        store = self.store
+        return [
+            {"name": store.names[row], "id": store.ids[row], "features": FeatureRow(store, row)}
+            for row in store.rows_of_artist(artist).tolist()
+        ]
+
+    def __contains__(self, artist):
+        return artist in self.store.artists.lookup()
+
+    def __iter__(self):
+        return iter(self.store.artists)
+
+    def __len__(self):
+        return len(self.store.artists)
+
+
+class MusicFeaturesView(Mapping):  # track id -> GenreRefs of the genres the track joins to
+    def __init__(self, store, genre_table):
+        self.genre_table = genre_table
+        self._refs = {}  # a repeated id keeps its first position and its last row, like the dict
+        self.add_rows(store)
+
+    def add_rows(self, store, first_row=0):
+        # switch to store and add its rows from first_row on, rows appended by extend_store only cost their own
+        self.store = store
+        genre_table = self.genre_table
+        if store.genre_offsets is not None:
+            offsets = store.genre_offsets[first_row:].tolist()
+            genre_ids = store.genre_ids
+            for row in range(len(offsets) - 1):
+                if offsets[row] != offsets[row + 1]:
+                    refs = GenreRefs(genre_table, genre_ids[offsets[row]:offsets[row + 1]].tolist())
+                    self._refs[store.ids[first_row + row]] = refs
+        else:
+            # no genre column, tracks join on key and share one GenreRefs per key
+            by_key = [genre_table.by_key.get(label) for label in store.key_labels] + [None]  # index -1 is "no key"
+            for row, key_code in enumerate(store.keys[first_row:].tolist(), first_row):
+                refs = by_key[key_code]
+                if refs is not None:
+                    self._refs[store.ids[row]] = refs
+
+    def __getitem__(self, track_id):
+        return self._refs[track_id]
+
+    def __contains__(self, track_id):
+        return track_id in self._refs
+
+    def __iter__(self):
+        return iter(self._refs)
+
+    def __len__(self):
+        return len(self._refs)
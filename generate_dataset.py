@@ -0,0 +1,153 @@
+import argparse
+import os
+import random
+
+import numpy as np
+
+from genre_table import GENRE_FEATURES
+
+# writes synthetic data.csv / data_genres.csv files with the same columns as the real dataset, for benchmarks.
+# the same rows and seed always give the same bytes, so timings can be compared between commits
+
+DATA_COLUMNS = ("valence", "year", "acousticness", "artists", "danceability", "duration_ms", "energy", "explicit",
+                "id", "instrumentalness", "key", "liveness", "loudness", "mode", "name", "popularity",
+                "release_date", "speechiness", "tempo")
+GENRE_COLUMNS = ("mode", "genres", "acousticness", "danceability", "duration_ms", "energy", "instrumentalness",
+                 "liveness", "loudness", "speechiness", "tempo", "valence", "popularity", "key")
+ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+WORDS = ("love", "night", "blue", "dance", "river", "fire", "heart", "road", "moon", "summer", "dream", "city",
+         "rain", "gold", "home", "light", "wild", "song", "star", "time", "baby", "sweet", "lonely", "forever")
+CHUNK_ROWS = 100000  # rows generated and written at a time
+SIZES = {"10k": 10000, "100k": 100000, "1m": 1000000, "5m": 5000000}
+
+
+def parse_size(text):
+    return SIZES.get(text.lower()) or int(text)
+
+
+def track_id(number):
+    # 22 character base62 id like spotify's, unique per row number
+    value = number * 2654435761 + 12345  # spread neighbouring numbers over the alphabet
+    digits = []
+    for _ in range(22):
+        value, digit = divmod(value, 62)
+        digits.append(ID_ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def artist_name(number):
+    return f"{WORDS[number % len(WORDS)].title()} {WORDS[number // len(WORDS) % len(WORDS)].title()} {number}"
+
+
+def track_name(rng):
+    # plain titles, titles with commas (quoted in the csv like the real file) and featuring credits
+    words = " ".join(rng.choices(WORDS, k=rng.randint(1, 4))).title()
+    kind = rng.random()
+    if kind < 0.1:
+        return f'"{words}, Op. {rng.randint(1, 99)}: {rng.choice(WORDS).title()}"'
+    if kind < 0.12:
+        return f"{words} (feat. {rng.choice(WORDS).title()})"
+    return words
+
+
+def artists_field(numbers):
+    # one artist is written bare, several are a quoted list with commas inside, like the real file
+    names = ", ".join(f"'{artist_name(number)}'" for number in numbers)
+    return f'"[{names}]"' if len(numbers) > 1 else f"[{names}]"
+
+
+def write_data(path, rows, seed=0, artists=None, bad_every=0):
+    rng = np.random.default_rng(seed)  # whole columns at a time
+    row_rng = random.Random(seed)  # the per-row strings, cheaper than numpy for single draws
+    artist_count = artists or max(10, rows // 5)
+    with open(path, "w", encoding="utf-8", newline="\n") as file:
+        file.write(",".join(DATA_COLUMNS) + "\n")
+        for start in range(0, rows, CHUNK_ROWS):
+            count = min(CHUNK_ROWS, rows - start)
+            # popular artists have many tracks: zipf-like draw over the artist numbers
+            credited = np.minimum((rng.pareto(1.2, (count, 3)) * artist_count / 50).astype(np.int64), artist_count - 1)
+            credit_counts = rng.choice([1, 1, 1, 1, 1, 1, 2, 2, 3], count).tolist()
+            year = rng.integers(1921, 2021, count).tolist()
+            columns = {
+                "valence": rng.random(count).round(4),
+                "acousticness": rng.random(count).round(4),
+                "danceability": rng.random(count).round(3),
+                "duration_ms": rng.integers(30000, 900000, count),
+                "energy": rng.random(count).round(3),
+                "explicit": (rng.random(count) < 0.1).astype(np.int64),
+                "instrumentalness": (rng.random(count) ** 4).round(4),
+                "key": rng.integers(0, 12, count),
+                "liveness": rng.random(count).round(3),
+                "loudness": (-rng.gamma(2.0, 5.0, count)).round(3),
+                "mode": rng.integers(0, 2, count),
+                "popularity": rng.integers(0, 101, count),
+                "speechiness": (rng.random(count) ** 3).round(4),
+                "tempo": rng.normal(118, 30, count).clip(30, 240).round(3),
+            }
+            columns = {name: values.tolist() for name, values in columns.items()}
+            credited = credited.tolist()
+            lines = []
+            for row in range(count):
+                number = start + row
+                values = {name: values[row] for name, values in columns.items()}
+                values["year"] = year[row]
+                values["release_date"] = f"{year[row]}-{row_rng.randint(1, 12):02d}-{row_rng.randint(1, 28):02d}"
+                values["artists"] = artists_field(list(dict.fromkeys(credited[row][:credit_counts[row]])))
+                values["id"] = track_id(number)
+                values["name"] = track_name(row_rng)
+                if bad_every and number % bad_every == bad_every - 1:
+                    values["tempo"] = "bad"  # a row the loader has to skip
+                lines.append(",".join(str(values[column]) for column in DATA_COLUMNS))
+            file.write("\n".join(lines) + "\n")
+
+
+def write_genres(path, genres=3000, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    with open(path, "w", encoding="utf-8", newline="\n") as file:
+        file.write(",".join(GENRE_COLUMNS) + "\n")
+        for number in range(genres):
+            values = {feature: float(rng.random()) for feature in GENRE_FEATURES}
+            values.update({
+                "duration_ms": float(rng.uniform(120000, 400000)),
+                "loudness": float(-rng.gamma(2.0, 5.0)),
+                "tempo": float(rng.normal(118, 20)),
+                "popularity": float(rng.uniform(0, 80)),
+                "mode": int(rng.integers(0, 2)),
+                "key": int(rng.integers(0, 12)),
+                "genres": f"{WORDS[number % len(WORDS)]} {WORDS[number // len(WORDS) % len(WORDS)]} {number}",
+            })
+            file.write(",".join(str(values[column]) for column in GENRE_COLUMNS) + "\n")
+
+
+def dataset_paths(folder, rows, seed=0, bad_every=0):
+    # generated files are named after their parameters and reused when they already exist
+    suffix = f"{rows}-s{seed}" + (f"-b{bad_every}" if bad_every else "")
+    return os.path.join(folder, f"data-{suffix}.csv"), os.path.join(folder, f"data_genres-s{seed}.csv")
+
+
+def ensure_dataset(folder, rows, seed=0, bad_every=0):
+    os.makedirs(folder, exist_ok=True)
+    data_path, genre_path = dataset_paths(folder, rows, seed, bad_every)
+    if not os.path.exists(genre_path):
+        write_genres(genre_path + ".tmp", seed=seed)
+        os.replace(genre_path + ".tmp", genre_path)
+    if not os.path.exists(data_path):
+        write_data(data_path + ".tmp", rows, seed, bad_every=bad_every)
+        os.replace(data_path + ".tmp", data_path)  # an interrupted run never leaves a short file behind
+    return data_path, genre_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic data.csv / data_genres.csv files.")
+    parser.add_argument("sizes", nargs="*", default=["10k", "100k", "1m", "5m"], help="rows, e.g. 10k 100k 1m 5m")
+    parser.add_argument("--folder", default="bench_data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bad-every", type=int, default=0, help="make every n-th row unparsable, 0 for none")
+    args = parser.parse_args(argv)
+    for size in args.sizes:
+        data_path, genre_path = ensure_dataset(args.folder, parse_size(size), args.seed, args.bad_every)
+        print(f"{data_path} ({os.path.getsize(data_path) / 1e6:.1f} MB), {genre_path}")
+
+
+if __name__ == "__main__":
+    main()
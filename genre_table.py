@@ -0,0 +1,132 @@
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+GENRE_FEATURES = (
+    "acousticness",
+    "danceability",
+    "duration_ms",
+    "energy",
+    "instrumentalness",
+    "liveness",
+    "loudness",
+    "speechiness",
+    "tempo",
+    "valence",
+    "popularity",
+)  # columns of data_genres.csv kept for every genre, in the order the features dicts are built
+
+
+# Function to safely convert value to float, with a default value 0.0 if conversion fails in case if we get a string in the data this will tackle
+def safe_float(value, default=0.0):
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+class GenreTable(Mapping):  # every genre of data_genres.csv stored once, behaves like the old key -> genre entries dict
+    def __init__(self, names, keys, matrix, feature_names=GENRE_FEATURES):
+        self.names = list(names)  # genre name per genre id
+        self.keys = list(keys)  # musical key string per genre id
+        self.matrix = matrix  # (genres, features) matrix
+        self.feature_names = tuple(feature_names)
+        # one {"genre_name", "features"} entry per genre, every track that joins to a genre points at this same dict
+        self.entries = [
+            {"genre_name": name, "features": dict(zip(self.feature_names, values))}
+            for name, values in zip(self.names, np.asarray(matrix).tolist())
+        ]
+        self.ids_by_name = {}
+        for genre_id, name in enumerate(self.names):
+            self.ids_by_name.setdefault(name, genre_id)
+        # key -> GenreRefs shared by all tracks with that key, so a key join costs one reference per track
+        grouped = {}
+        for genre_id, track_key in enumerate(self.keys):
+            grouped.setdefault(track_key, []).append(genre_id)
+        self.by_key = {track_key: GenreRefs(self, ids) for track_key, ids in grouped.items()}
+
+    @classmethod
+    def from_csv(cls, genre_file_path):
+        names, keys, rows = [], [], []
+        with open(genre_file_path, 'r', encoding='utf-8') as genre_file: #opening the file in read mode
+            header = genre_file.readline().strip().split(',')
+            columns = {col: idx for idx, col in enumerate(header)} #map each column name to its index
+
+            for line in genre_file:
+                values = line.strip().split(',')
+                keys.append(values[columns["key"]].strip())
+                #handling exception if  no genres column found return Unknown else assign the genre name
+                names.append(values[columns["genres"]].strip() if "genres" in columns else "Unknown")
+                rows.append([safe_float(values[columns[feature]]) for feature in GENRE_FEATURES])
+
+        matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(GENRE_FEATURES))
+        return cls(names, keys, matrix)
+
+    def refs_for_names(self, genre_names):
+        # GenreRefs for the genre names listed on a track, unknown names are ignored
+        ids = [self.ids_by_name[name] for name in genre_names if name in self.ids_by_name]
+        return GenreRefs(self, ids) if ids else None
+
+    def __getitem__(self, track_key):
+        return self.by_key[track_key]
+
+    def __iter__(self):
+        return iter(self.by_key)
+
+    def __len__(self):
+        return len(self.by_key)
+
+
+class SharedGroups:  # the distinct objects among the values of a mapping, by identity, with the keys that hold each
+    # tracks joined on key all hold their key's one GenreRefs, statistics, the feature index and the normalizer read
+    # such a shared list once and count it for every key
+    def __init__(self):
+        self.numbers = {}  # id(items) -> group number
+        self.items = []  # the grouped objects, first seen first. keeps them alive so their ids stay unique
+        self.key_positions = []  # group number -> positions (in the mapping's order) of the keys holding it
+
+    @classmethod
+    def of(cls, mapping):
+        groups = cls()
+        for key_position, items in enumerate(mapping.values()):
+            groups.add(items, key_position)
+        return groups
+
+    def find(self, items):
+        # group number of items, None when they were never added
+        return self.numbers.get(id(items))
+
+    def add(self, items, key_position):
+        group = self.numbers.get(id(items))
+        if group is None:
+            group = self.numbers[id(items)] = len(self.items)
+            self.items.append(items)
+            self.key_positions.append([])
+        self.key_positions[group].append(key_position)
+        return group
+
+    def counts(self):
+        # how many keys hold each group
+        return [len(positions) for positions in self.key_positions]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class GenreRefs(Sequence):  # small list of genre ids that reads like the old list of genre entry dicts
+    __slots__ = ("table", "ids")
+
+    def __init__(self, table, ids):
+        self.table = table
+        self.ids = tuple(ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.table.entries[genre_id] for genre_id in self.ids[index]]
+        return self.table.entries[self.ids[index]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return repr(list(self))
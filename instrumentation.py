@@ -0,0 +1,257 @@
+import argparse
+import contextlib
+import cProfile
+import functools
+import gc
+import importlib
+import inspect
+import io
+import json
+import pstats
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+
+# opt-in timing of the loader, statistics and similarity code. nothing is wrapped until enable() is called, and
+# disable() puts the original functions back, so a disabled run executes exactly the code it did before.
+#   instrumentation.enable(); processor.load_data(); ...; print(instrumentation.report())
+#   python instrumentation.py --json report.json --profile run.prof --tracemalloc batch_cli.py queries.jsonl
+# the dicts in REGISTRIES are patched as well, other callers that looked a function up before enable() keep the
+# plain version
+
+# (module, class, methods, kind): "stage" methods are long and also record memory and object count changes,
+# "call" methods are hot and only count calls and time
+TARGETS = (
+    ("load_data_set", "MusicDataProcessor",
+     ("load_data", "load_genre_data", "load_music_data", "load_music_data_legacy", "update_data"), "stage"),
+    ("load_data_set", "MusicDataProcessor", ("query_similarity", "query_best_feature"), "call"),
+    ("statistical_functions", "FeatureStatistics", ("calculate_statistics", "query_best_feature"), "stage"),
+    ("statistical_functions", "FeatureStatistics", ("normalize_features",), "call"),
+    ("similarity_module", "SimilarityMeasures",
+     ("compute_similarity", "euclidean_similarity", "cosine_similarity", "pearson_similarity",
+      "jaccard_similarity", "manhattan_similarity"), "call"),
+    ("feature_index", "FeatureIndex", ("query_best_feature",), "call"),
+    ("recommendation", "Recommender", ("most_similar",), "call"),
+)
+# (module, dict) of functions looked up by name, e.g. the metric the user typed. entries that are wrapped targets
+# are swapped for the wrappers so the real query paths are timed too
+REGISTRIES = (
+    ("similarity_module", "SIMILARITY_FUNCTIONS"),
+)
+SKIPPED_IDS_KEPT = 100  # track ids of skipped rows listed in the report
+
+_lock = threading.Lock()
+_originals = []  # (class, name, raw attribute) of everything currently wrapped
+_registry_originals = []  # (dict, key, function) of every registry entry currently replaced
+_stages = {}  # "Class.method" -> totals
+_counters = {}
+_skipped_ids = []
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def new_record():
+    return {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+
+def add_time(record, elapsed):
+    record["calls"] += 1
+    record["seconds"] += elapsed
+    if elapsed > record["max_seconds"]:
+        record["max_seconds"] = elapsed
+
+
+def count(name, amount=1):
+    # free-form counter, only kept while enabled. the loader and the caches count snapshot, result cache and
+    # lazy row cache hits / misses and rows added by update_data with it
+    if is_enabled():
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+
+def after_load(processor, record):
+    # rows loaded and skipped of the load that just finished, from the loader's own report. load_data sets it on
+    # every path: csv, snapshot and lazy offset index
+    report = processor.load_report
+    record["rows"] = record.get("rows", 0) + report.get("rows", 0)
+    record["rows_skipped"] = record.get("rows_skipped", 0) + report.get("skipped", 0)
+    room = SKIPPED_IDS_KEPT - len(_skipped_ids)
+    if room > 0:
+        _skipped_ids.extend(report.get("skipped_ids", ())[:room])
+
+
+AFTER = {"MusicDataProcessor.load_data": after_load}
+
+
+def wrap_call(key, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                add_time(_stages[key], elapsed)
+    return wrapper
+
+
+def wrap_stage(key, function):
+    after = AFTER.get(key)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        tracing = tracemalloc.is_tracing()
+        memory_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        objects_before = len(gc.get_objects())
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                record = _stages[key]
+                add_time(record, elapsed)
+                record["objects_delta"] = record.get("objects_delta", 0) + len(gc.get_objects()) - objects_before
+                if tracing:
+                    record["memory_delta_bytes"] = (record.get("memory_delta_bytes", 0)
+                                                    + tracemalloc.get_traced_memory()[0] - memory_before)
+                if after is not None and args:
+                    after(args[0], record)
+    return wrapper
+
+
+def enable():
+    # wrap every target in place, calling it twice is harmless
+    with _lock:
+        if _originals:
+            return
+        for module_name, class_name, methods, kind in TARGETS:
+            owner = getattr(importlib.import_module(module_name), class_name)
+            for name in methods:
+                raw = inspect.getattr_static(owner, name)
+                key = f"{class_name}.{name}"
+                _stages.setdefault(key, new_record())
+                wrap = wrap_stage if kind == "stage" else wrap_call
+                if isinstance(raw, staticmethod):
+                    setattr(owner, name, staticmethod(wrap(key, raw.__func__)))
+                else:
+                    setattr(owner, name, wrap(key, raw))
+                _originals.append((owner, name, raw))
+        wrapped = {id(getattr(raw, "__func__", raw)): getattr(owner, name) for owner, name, raw in _originals}
+        for module_name, dict_name in REGISTRIES:
+            functions = getattr(importlib.import_module(module_name), dict_name)
+            for key, function in functions.items():
+                if id(function) in wrapped:
+                    functions[key] = wrapped[id(function)]
+                    _registry_originals.append((functions, key, function))
+
+
+def disable():
+    # restore the original functions, the collected numbers stay until reset()
+    with _lock:
+        while _originals:
+            owner, name, raw = _originals.pop()
+            setattr(owner, name, raw)
+        while _registry_originals:
+            functions, key, function = _registry_originals.pop()
+            functions[key] = function
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        del _skipped_ids[:]
+
+
+def peak_rss_mb():
+    # high-water mark of this process so far. linux reports KiB, macOS bytes; not available on windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def report():
+    # everything collected so far as plain json-able data
+    with _lock:
+        stages = {}
+        for key, record in sorted(_stages.items()):
+            if record["calls"]:
+                stages[key] = dict(record, mean_ms=record["seconds"] / record["calls"] * 1000)
+        result = {
+            "enabled": bool(_originals),
+            "stages": stages,
+            "counters": dict(_counters),
+            "skipped_ids": list(_skipped_ids),
+        }
+    memory = {"peak_rss_mb": peak_rss_mb(), "gc_objects": len(gc.get_objects())}
+    if tracemalloc.is_tracing():
+        memory["traced_current_bytes"], memory["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+    result["memory"] = memory
+    return result
+
+
+def dump_json(path, extra=None):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({**report(), **(extra or {})}, file, indent=2, sort_keys=True)
+
+
+@contextlib.contextmanager
+def profiling(profile_path=None, trace_memory=False, top=25):
+    # instrumentation plus cProfile and, optionally, tracemalloc around a block. yields a dict that is filled with
+    # the hottest functions and the biggest allocation sites when the block ends
+    extra = {}
+    profiler = cProfile.Profile()
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    enable()
+    profiler.enable()
+    try:
+        yield extra
+    finally:
+        profiler.disable()
+        if profile_path:
+            profiler.dump_stats(profile_path)  # open with `python -m pstats` or snakeviz
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+        extra["profile"] = text.getvalue().splitlines()
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            extra["allocations"] = [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+            extra["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        disable()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a script with instrumentation and profiling switched on.")
+    parser.add_argument("--json", default="instrumentation.json", help="where the report is written")
+    parser.add_argument("--profile", help="also save the raw cProfile stats here")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace allocations (slows the run down)")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    sys.argv = [args.script] + args.args
+    with profiling(args.profile, args.tracemalloc) as extra:
+        try:
+            runpy.run_path(args.script, run_name="__main__")
+        except SystemExit:
+            pass
+    dump_json(args.json, extra)
+    print(f"instrumentation report written to {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # run main() in the module the loader and the caches import, not in this __main__ copy of it, so their
+    # count() calls and the wrapped functions share one set of counters and stages
+    importlib.import_module("instrumentation").main()
@@ -0,0 +1,336 @@
+import bisect
+import io
+import json
+import mmap
+import os
+import shutil
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from itertools import islice
+
+import numpy as np
+
+import instrumentation
+from csv_ingest import MusicCsvReader
+from feature_store import FEATURE_NAMES
+from snapshot_cache import file_fingerprint
+
+# low memory mode: tracks stay in data.csv. a small index of where lines start is built on the first open and saved
+# next to the csv (data.csv.offsets/), lookups seek into the memory mapped file and parse only the lines they need.
+# memory is the index pages the os keeps mapped plus an LRU of decoded lines, whatever the size of the catalog
+
+OFFSET_INDEX_VERSION = 1  # bump whenever the files written below change shape or meaning
+CACHE_ROWS = 4096  # decoded lines kept in memory
+INDEX_CHUNK_ROWS = 50000  # lines parsed at a time while the index is built
+ITER_BLOCK = 65536  # order entries turned into python ints at a time while iterating
+SCAN_CHUNK_ROWS = 8192  # lines parsed at a time by a scan of the whole catalog, keeps its peak memory small
+
+
+class SortedStrings:  # sorted strings as a utf-8 blob plus offsets, searched with bisect without decoding them all
+    def __init__(self, blob, offsets):
+        self.blob = blob  # uint8 array, memory mapped when loaded from disk
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        # strings must already be sorted, utf-8 byte order is the same as python's code point order
+        encoded = [value.encode("utf-8") for value in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    def find(self, value):
+        # position of value, -1 when it is not in the table
+        position = bisect.bisect_left(self, value)
+        return position if position < len(self) and self[position] == value else -1
+
+
+class OffsetIndex:  # byte offsets of the lines of data.csv, by track id and by artist
+    ARRAYS = ("track_ids_blob", "track_ids_offsets", "track_lines", "track_order",
+              "artists_blob", "artists_offsets", "artist_offsets", "artist_lines", "artist_order")
+
+    def __init__(self, arrays, columns, rows, skipped):
+        # track_*: tracks that join a genre (the keys of music_features), sorted by id. track_lines is the line the
+        # dict would end up holding (the last joining one), track_order lists them in the order the dict would
+        # artist_*: sorted by name, artist_lines[artist_offsets[i]:artist_offsets[i + 1]] are artist i's lines in
+        # file order, artist_order gives the artist_music order
+        self.arrays = arrays
+        self.track_ids = SortedStrings(arrays["track_ids_blob"], arrays["track_ids_offsets"])
+        self.track_lines = arrays["track_lines"]
+        self.track_order = arrays["track_order"]
+        self.artists = SortedStrings(arrays["artists_blob"], arrays["artists_offsets"])
+        self.artist_offsets = arrays["artist_offsets"]
+        self.artist_lines = arrays["artist_lines"]
+        self.artist_order = arrays["artist_order"]
+        self.columns = columns  # data.csv column -> position, from its header
+        self.rows = rows
+        self.skipped = skipped
+
+    @classmethod
+    def build(cls, file_path, genre_data, progress=None, chunk_rows=INDEX_CHUNK_ROWS):
+        # one pass over the file with the normal parser, so the index holds exactly the rows a full load keeps.
+        # returns (index, reader), the reader has the skipped row counts
+        reader = MusicCsvReader(file_path, chunk_rows)
+        track_lines = {}  # track id -> offset, insertion order and overwrites follow music_features
+        artist_codes = {}  # artist -> code in first seen order, the artist_music order
+        pair_artists = array("q")  # one (artist code, line offset) pair per credit
+        pair_lines = array("q")
+        total_bytes = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            header = file.readline()
+            columns = reader.read_header(io.StringIO(header.decode("utf-8")))
+            offset = len(header)
+            while True:
+                lines = list(islice(file, chunk_rows))
+                if not lines:
+                    break
+                starts = []
+                for line in lines:
+                    starts.append(offset)
+                    offset += len(line)
+                chunk = reader.parse_lines([line.decode("utf-8") for line in lines], columns)
+                reader.rows_parsed += len(chunk)
+                if chunk.positions is not None:  # some lines were skipped
+                    starts = [starts[position] for position in chunk.positions]
+                for row, start in enumerate(starts):
+                    for artist in chunk.artists[row]:
+                        pair_artists.append(artist_codes.setdefault(artist, len(artist_codes)))
+                        pair_lines.append(start)
+                    if chunk.genres is not None:
+                        joins = genre_data.refs_for_names(chunk.genres[row]) is not None
+                    else:
+                        joins = bool(chunk.keys[row]) and chunk.keys[row] in genre_data
+                    if joins:
+                        track_lines[chunk.ids[row]] = start
+                if progress is not None:
+                    progress(reader.rows_parsed, offset, total_bytes)
+
+        track_ids = list(track_lines)
+        track_sorted = sorted(range(len(track_ids)), key=track_ids.__getitem__)
+        artists = list(artist_codes)
+        artist_sorted = np.array(sorted(range(len(artists)), key=artists.__getitem__), dtype=np.int64)
+        artist_rank = np.empty(len(artists), dtype=np.int64)  # first seen code -> sorted position
+        artist_rank[artist_sorted] = np.arange(len(artists))
+        pair_ranks = artist_rank[np.frombuffer(pair_artists, dtype=np.int64)] if len(pair_artists) else \
+            np.zeros(0, dtype=np.int64)
+        by_artist = np.argsort(pair_ranks, kind="stable")  # stable keeps every artist's lines in file order
+        artist_offsets = np.zeros(len(artists) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_ranks, minlength=len(artists)), out=artist_offsets[1:])
+        track_rank = np.empty(len(track_ids), dtype=np.int64)
+        track_rank[np.array(track_sorted, dtype=np.int64)] = np.arange(len(track_ids))
+
+        sorted_ids = SortedStrings.from_strings([track_ids[position] for position in track_sorted])
+        sorted_artists = SortedStrings.from_strings([artists[position] for position in artist_sorted.tolist()])
+        line_offsets = np.fromiter(track_lines.values(), dtype=np.int64, count=len(track_lines))
+        arrays = {
+            "track_ids_blob": sorted_ids.blob,
+            "track_ids_offsets": sorted_ids.offsets,
+            "track_lines": line_offsets[np.array(track_sorted, dtype=np.int64)],
+            "track_order": track_rank,
+            "artists_blob": sorted_artists.blob,
+            "artists_offsets": sorted_artists.offsets,
+            "artist_offsets": artist_offsets,
+            "artist_lines": np.frombuffer(pair_lines, dtype=np.int64)[by_artist] if len(pair_lines) else
+            np.zeros(0, dtype=np.int64),
+            "artist_order": artist_rank,
+        }
+        return cls(arrays, columns, reader.rows_parsed, reader.rows_skipped), reader
+
+    @classmethod
+    def load(cls, path, sources):
+        # memory mapped index, or None when there is none or it does not match the current csv files
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("version") != OFFSET_INDEX_VERSION or meta.get("sources") != sources:
+                return None
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in cls.ARRAYS}
+            index = cls(arrays, meta["columns"], meta["rows"], meta["skipped"])
+            if len(index.artist_offsets) != len(index.artists) + 1 or len(index.track_lines) != len(index.track_ids):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None  # missing or corrupted files, the caller builds the index again
+        return index
+
+    def save(self, path, sources):
+        # same layout and swap as SnapshotCache.save
+        temp_path = path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name in self.ARRAYS:
+            np.save(os.path.join(temp_path, name + ".npy"), np.ascontiguousarray(self.arrays[name]))
+        meta = {"version": OFFSET_INDEX_VERSION, "sources": sources, "columns": self.columns,
+                "rows": self.rows, "skipped": self.skipped}
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+
+
+class LazyRow:  # one decoded line of data.csv
+    __slots__ = ("track_id", "name", "key", "features", "genres")
+
+    def __init__(self, track_id, name, key, features, genres):
+        self.track_id = track_id
+        self.name = name
+        self.key = key
+        self.features = features  # the same dict a full load would build
+        self.genres = genres  # genre names, None when data.csv has no genres column
+
+
+class LazyCatalog:  # memory mapped data.csv plus its OffsetIndex, lines are parsed on demand and kept in an LRU
+    def __init__(self, file_path, index, genre_data, cache_rows=CACHE_ROWS, reader=None):
+        self.file_path = file_path
+        self.index = index
+        self.genre_data = genre_data
+        self.cache_rows = cache_rows
+        self.reader = MusicCsvReader(file_path)
+        self.build_reader = reader  # the reader that built the index this time, None when it was loaded
+        self._file = open(file_path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(file_path) else b""
+        self._cache = OrderedDict()  # line offset -> LazyRow, oldest first
+        self._lock = threading.Lock()  # queries run on worker threads
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, file_path, genre_file_path, genre_data, progress=None, cache_rows=CACHE_ROWS):
+        # the index depends on the genre file too, it decides which tracks join a genre
+        path = file_path + ".offsets"
+        sources = {"data": file_fingerprint(file_path), "genres": file_fingerprint(genre_file_path)}
+        index = OffsetIndex.load(path, sources)
+        if index is not None:
+            return cls(file_path, index, genre_data, cache_rows)
+        index, reader = OffsetIndex.build(file_path, genre_data, progress)
+        index.save(path, sources)
+        # serve from the saved, memory mapped copy so nothing of the build stays in memory
+        return cls(file_path, OffsetIndex.load(path, sources) or index, genre_data, cache_rows, reader)
+
+    def line(self, offset):
+        end = self._data.find(b"\n", offset)
+        return self._data[offset:end if end >= 0 else len(self._data)].decode("utf-8")
+
+    def rows(self, offsets):
+        # LazyRow per line offset. lines missing from the LRU are parsed together, one parse_lines call per lookup
+        found = {}
+        missing = []
+        with self._lock:
+            for offset in offsets:
+                row = self._cache.get(offset)
+                if row is None:
+                    missing.append(offset)
+                else:
+                    self._cache.move_to_end(offset)
+                    found[offset] = row
+            self.hits += len(offsets) - len(missing)
+            self.misses += len(missing)
+        instrumentation.count("lazy_row_hits", len(offsets) - len(missing))
+        instrumentation.count("lazy_row_misses", len(missing))
+        if not missing:
+            return [found[offset] for offset in offsets]
+        missing = list(dict.fromkeys(missing))  # an artist credited twice on one line
+        chunk = self.reader.parse_lines([self.line(offset) for offset in missing], self.index.columns)
+        values = list(zip(*chunk.columns))  # indexed lines always parse, so rows line up with missing
+        for position, offset in enumerate(missing):
+            found[offset] = LazyRow(chunk.ids[position], chunk.names[position], chunk.keys[position],
+                                    dict(zip(FEATURE_NAMES, values[position])),
+                                    chunk.genres[position] if chunk.genres is not None else None)
+        with self._lock:
+            for offset in missing:
+                self._cache[offset] = found[offset]
+            while len(self._cache) > self.cache_rows:
+                self._cache.popitem(last=False)
+        return [found[offset] for offset in offsets]
+
+    def row(self, offset):
+        return self.rows([offset])[0]
+
+    def feature_values(self, offsets, chunk_rows=SCAN_CHUNK_ROWS):
+        # features of the lines at offsets as one (lines, features) matrix. parsed a chunk at a time and past the
+        # LRU, so a scan of the whole catalog neither evicts the cached rows nor builds a dict per row
+        values = np.empty((len(offsets), len(FEATURE_NAMES)))
+        for start in range(0, len(offsets), chunk_rows):
+            lines = [self.line(offset) for offset in offsets[start:start + chunk_rows].tolist()]
+            chunk = self.reader.parse_lines(lines, self.index.columns)
+            values[start:start + len(lines)] = np.array(chunk.columns, dtype=np.float64).reshape(len(FEATURE_NAMES), -1).T
+        return values
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def iter_ordered(strings, order):
+    for start in range(0, len(order), ITER_BLOCK):
+        for position in order[start:start + ITER_BLOCK].tolist():
+            yield strings[position]
+
+
+class LazyArtistMusic(Mapping):  # artist -> list of {"name", "id", "features"} entries, parsed from data.csv on access
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.index = catalog.index
+
+    def __getitem__(self, artist):
+        position = self.index.artists.find(artist)
+        if position < 0:
+            raise KeyError(artist)
+        lines = self.index.artist_lines[self.index.artist_offsets[position]:self.index.artist_offsets[position + 1]]
+        rows = self.catalog.rows(lines.tolist())
+        return [{"name": row.name, "id": row.track_id, "features": row.features} for row in rows]
+
+    def __contains__(self, artist):
+        return self.index.artists.find(artist) >= 0
+
+    def entry_table(self):
+        # every entry's features without building the entries: (values, offsets, lines) in artist_music order,
+        # values[offsets[i]:offsets[i + 1]] are the i-th artist's entries and lines their line offsets in data.csv
+        index = self.index
+        order = np.asarray(index.artist_order)
+        sizes = np.diff(index.artist_offsets)[order]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        starts = np.asarray(index.artist_offsets[:-1])[order]
+        lines = np.asarray(index.artist_lines)[np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[-1])]
+        distinct, line_rows = np.unique(lines, return_inverse=True)  # a line credited to several artists is read once
+        return self.catalog.feature_values(distinct)[line_rows], offsets, lines
+
+    def __iter__(self):
+        return iter_ordered(self.index.artists, self.index.artist_order)
+
+    def __len__(self):
+        return len(self.index.artist_order)
+
+
+class LazyMusicFeatures(Mapping):  # track id -> the genres it joins to, parsed from data.csv on access
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.index = catalog.index
+
+    def __getitem__(self, track_id):
+        position = self.index.track_ids.find(track_id)
+        if position < 0:
+            raise KeyError(track_id)
+        row = self.catalog.row(int(self.index.track_lines[position]))
+        genre_data = self.catalog.genre_data
+        if row.genres is not None:
+            return genre_data.refs_for_names(row.genres)
+        return genre_data[row.key]  # shared by every track with this key, like in a full load
+
+    def __contains__(self, track_id):
+        return self.index.track_ids.find(track_id) >= 0
+
+    def __iter__(self):
+        return iter_ordered(self.index.track_ids, self.index.track_order)
+
+    def __len__(self):
+        return len(self.index.track_order)
@@ -1,60 +1,156 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import instrumentation
 from tabulate import tabulate
+from csv_ingest import MusicCsvReader, complete_lines_end
+from genre_table import GenreTable
+from feature_store import ArtistMusicView, FeatureStoreBuilder, MusicFeaturesView, FEATURE_NAMES, extend_store, store_from_artist_music
+from snapshot_cache import SnapshotCache, prefix_digest
+from statistical_functions import FeatureStatistics
+from streaming_stats import SCAN_SHIFT, StreamingStatistics
+from recommendation import Recommender
+from feature_index import FeatureIndex
+from artist_profiles import ArtistProfiles
+from normalization import FeatureNormalizer
+from sharded_loader import ShardedCsvLoader, merge_stores
+from lazy_store import LazyArtistMusic, LazyCatalog, LazyMusicFeatures
+from result_cache import DEFAULT_ENTRIES, ResultCache, feature_key, similarity_key
+from similarity_module import SIMILARITY_FUNCTIONS, SimilarityMeasures
 
 
 class MusicDataProcessor: # music data processor class to load data from data set and save data in dictionaries
-    def __init__(self, file_path, genre_file_path): #initializer 
+    def __init__(self, file_path, genre_file_path, columnar=False, use_cache=False, index_metrics=(), workers=1, lazy=False,
+                 result_cache_entries=DEFAULT_ENTRIES): #initializer 
         self.file_path = file_path #artist music data set path
         self.genre_file_path = genre_file_path #genre data set path
+        self.lazy = lazy #leave the tracks in data.csv and parse them on access through an offset index, for little memory
+        self.columnar = not lazy and (columnar or use_cache or bool(index_metrics)) #store features in one numpy matrix instead of a dict per track
+        self.use_cache = use_cache #keep a binary snapshot next to the csv and memory map it on later loads
+        self.index_metrics = tuple(index_metrics) #(kind, metric) pairs to build nearest neighbour indexes for at load time
+        self.workers = workers #processes that parse data.csv, more than 1 loads byte ranges of the file in parallel
+        self.recommender = None
+        self.data_version = 0 #bumped on every load so cached indexes and results know the data changed
+        self.feature_indexes = {} #"artist"/"track" -> FeatureIndex, built on first use for the current data_version
+        self.artist_profiles = {} #weighted flag -> ArtistProfiles of the current data_version
+        self.normalizers = {} #"artist"/"track"/"store" -> FeatureNormalizer of the current data_version
+        self.statistics = {} #"artist"/"track" -> StreamingStatistics behind get_statistics
+        self.genre_data = None #GenreTable of the last load
         self.artist_music = {} #empty dictionaries to store data
         self.music_features = {}
+        self.store = None #ColumnarFeatureStore, only filled in columnar mode
+        self.catalog = None #LazyCatalog, only filled in lazy mode
+        self.load_report = {} #rows parsed, rows skipped and rows/sec of the last load
+        self.consumed_bytes = 0 #how much of data.csv is loaded, update_data parses what was appended after it
+        self.head_digest = None #prefix_digest of data.csv at that point, to notice a rewritten file
+        self.update_report = {} #rows added and time taken by the last update_data
+        self.result_cache = ResultCache(result_cache_entries) #answers of query_similarity / query_best_feature, emptied when the data changes
+        #the get_* builders below run under this lock: queries run on worker threads (the GUI, the service) and a
+        #query the GUI cancelled keeps running, so two of them can ask for the same structure at once. reentrant
+        #because builders call each other
+        self.build_lock = threading.RLock()
 
     def load_genre_data(self): #load genre data function to retrieve genre data from genres dataset
-        genre_data = {} #empty dictionary
-
-        with open(self.genre_file_path, 'r', encoding='utf-8') as genre_file: #opening the file in read mode
-            header = genre_file.readline().strip().split(',') #reading  the file data by spliting using , and strip function to cut unsual spaces from the data
-            columns = {col: idx for idx, col in enumerate(header)} #enumerate builtin function to map each column name to its index
-
-            # Process each row in the genre file
-            for line in genre_file:
-                values = line.strip().split(',')
-                track_key = values[columns["key"]].strip()  # remove spaces from key using strip function 
-
-                #handling exception if  no genres column found return Unknown else assign the genre name 
-                genre_name = values[columns["genres"]].strip() if "genres" in columns else "Unknown"
-                
-                # Function to safely convert value to float, with a default value 0.0 if conversion fails in case if we get a string in the data this will tackle
-                def safe_float(value, default=0.0):
-                    try:
-                        return float(value)
-                    except ValueError:
-                        return default
-                    #storing features in a dictionary
-                features = {
-                    "acousticness": safe_float(values[columns["acousticness"]]),
-                    "danceability": safe_float(values[columns["danceability"]]),
-                    "duration_ms": safe_float(values[columns["duration_ms"]]),
-                    "energy": safe_float(values[columns["energy"]]),
-                    "instrumentalness": safe_float(values[columns["instrumentalness"]]),
-                    "liveness": safe_float(values[columns["liveness"]]),
-                    "loudness": safe_float(values[columns["loudness"]]),
-                    "speechiness": safe_float(values[columns["speechiness"]]),
-                    "tempo": safe_float(values[columns["tempo"]]),
-                    "valence": safe_float(values[columns["valence"]]),
-                    "popularity": safe_float(values[columns["popularity"]]),
-                }
-
-                # If the track key is already in genre_data, append the genre and its features
-                #this is for storing multiple genres against single Id because one song can have multiple genres
-                if track_key in genre_data:
-                    genre_data[track_key].append({"genre_name": genre_name, "features": features})
-                #else store genre name and features in genre daa
-                else:
-                    genre_data[track_key] = [{"genre_name": genre_name, "features": features}]
-        
-        return genre_data
+        # every genre is kept once in a GenreTable, tracks only hold references to it.
+        # the table still reads like the old key -> list of {"genre_name", "features"} dict
+        return GenreTable.from_csv(self.genre_file_path)
+
     #load aritst music data
-    def load_music_data(self, genre_data):
+    def load_music_data(self, genre_data, progress=None):
+        # progress, when given, is called as progress(rows, bytes_read, total_bytes) after every chunk
+        if self.workers > 1:
+            self.load_music_data_sharded(genre_data, progress)
+            return
+        reader = MusicCsvReader(self.file_path, 10000 if progress is not None else 50000) #smaller blocks give a smoother progress bar
+        builder = FeatureStoreBuilder() if self.columnar else None
+        total_bytes = os.path.getsize(self.file_path)
+        start = time.perf_counter()
+
+        for chunk in reader.chunks(): #blocks of rows already split and converted column by column
+            if chunk.genres is not None: #data.csv lists genres per track, join on them instead of the key
+                chunk.genre_refs = [genre_data.refs_for_names(genre_names) for genre_names in chunk.genres]
+            if builder is not None:
+                builder.add_chunk(chunk) # in columnar mode rows go into the store and the dictionaries become views over it
+            else:
+                self.add_chunk_to_dicts(chunk, genre_data)
+            if progress is not None:
+                progress(reader.rows_parsed, min(reader.bytes_read, total_bytes), total_bytes)
+
+        if builder is not None:
+            self.store = builder.build()
+            self.artist_music = ArtistMusicView(self.store)
+            self.music_features = MusicFeaturesView(self.store, genre_data)
+
+        elapsed = time.perf_counter() - start
+        self.load_report = {
+            "rows": reader.rows_parsed,
+            "skipped": reader.rows_skipped,
+            "skipped_ids": reader.skipped_ids,
+            "seconds": elapsed,
+            "rows_per_sec": reader.rows_parsed / elapsed if elapsed > 0 else 0.0,
+        }
+
+    #same result as load_music_data, with the parsing spread over self.workers processes (see sharded_loader)
+    def load_music_data_sharded(self, genre_data, progress=None):
+        loader = ShardedCsvLoader(self.file_path, self.workers)
+        start = time.perf_counter()
+        stores = []
+
+        for shard in loader.results(genre_data, self.columnar): #shards arrive in file order
+            if self.columnar:
+                stores.append(shard.store)
+            else:
+                for chunk in shard.chunks:
+                    if chunk.genres is not None:
+                        chunk.genre_refs = [genre_data.refs_for_names(genre_names) for genre_names in chunk.genres]
+                    self.add_chunk_to_dicts(chunk, genre_data)
+            if progress is not None:
+                progress(loader.rows_parsed, shard.end, loader.size)
+
+        if self.columnar:
+            self.store = merge_stores(stores) if stores else FeatureStoreBuilder().build()
+            self.artist_music = ArtistMusicView(self.store)
+            self.music_features = MusicFeaturesView(self.store, genre_data)
+
+        elapsed = time.perf_counter() - start
+        self.load_report = {
+            "rows": loader.rows_parsed,
+            "skipped": loader.rows_skipped,
+            "skipped_ids": loader.skipped_ids,
+            "seconds": elapsed,
+            "rows_per_sec": loader.rows_parsed / elapsed if elapsed > 0 else 0.0,
+            "workers": self.workers,
+        }
+
+    def add_chunk_to_dicts(self, chunk, genre_data):
+        artist_music = self.artist_music
+        genre_refs = chunk.genre_refs
+        for row, (track_id, track_name, track_key, artists, values) in enumerate(zip(
+                chunk.ids, chunk.names, chunk.keys, chunk.artists, zip(*chunk.columns))):
+            features = dict(zip(FEATURE_NAMES, values))
+
+            # Populate artist_music dictionary
+            for artist in artists:
+                if artist not in artist_music:
+                    artist_music[artist] = []
+                artist_music[artist].append({
+                    "name": track_name,
+                    "id": track_id,
+                    "features": features,
+                })
+
+            # music_features keeps a reference to the track's genres instead of copying every genre entry
+            if genre_refs is not None:
+                if genre_refs[row] is not None:
+                    self.music_features[track_id] = genre_refs[row]
+            elif track_key and track_key in genre_data:
+                self.music_features[track_id] = genre_data[track_key] #shared by every track with this key
+
+    #original character by character parser, kept as the reference the fast loader is checked against
+    def load_music_data_legacy(self, genre_data):
         with open(self.file_path, 'r', encoding='utf-8') as file:
             # Read the header line and strip(removes spaces or tabs) and split with ,
             header = file.readline().strip().split(',')
@@ -145,10 +241,199 @@ class MusicDataProcessor: # music data processor class to load data from data se
                             "features": genre_entry["features"]
                         })
 
-    def load_data(self):
+    def load_data(self, progress=None): #progress(rows, bytes_read, total_bytes) reports how far the load is
+        start = time.perf_counter()
+        self.data_version += 1
+        self.feature_indexes = {}
+        self.artist_profiles = {}
+        self.normalizers = {}
+        self.statistics = {}
+        self.recommender = None
+        self.result_cache.clear()
+        self.consumed_bytes = os.path.getsize(self.file_path) #rows appended while loading are read again by update_data
+        self.head_digest = prefix_digest(self.file_path, self.consumed_bytes)
+        if self.lazy:
+            self.load_lazy(progress)
+            return
+        cache = SnapshotCache(self.file_path, self.genre_file_path) if self.use_cache else None
+
+        # warm start: a snapshot matching the current csv files is memory mapped instead of parsed
+        snapshot = cache.load() if cache is not None else None
+        if cache is not None:
+            instrumentation.count("snapshot_hits" if snapshot is not None else "snapshot_misses")
+        if snapshot is not None:
+            self.store, genre_data = snapshot
+            self.genre_data = genre_data
+            self.artist_music = ArtistMusicView(self.store)
+            self.music_features = MusicFeaturesView(self.store, genre_data)
+            self.load_report = {"source": "snapshot", "rows": len(self.store), "seconds": time.perf_counter() - start}
+            if progress is not None:
+                size = os.path.getsize(self.file_path)
+                progress(len(self.store), size, size)
+            self.build_indexes()
+            return
+
         # Load the genre data and music data
-        genre_data = self.load_genre_data()
-        self.load_music_data(genre_data)
+        genre_data = self.genre_data = self.load_genre_data()
+        self.load_music_data(genre_data, progress)
+        self.load_report["source"] = "csv"
+
+        if cache is not None:
+            cache.save(self.store, genre_data)
+        self.build_indexes()
+        self.load_report["total_seconds"] = time.perf_counter() - start #parse time plus writing the snapshot
+
+    def load_lazy(self, progress=None): #artist_music / music_features become views that read data.csv on demand
+        start = time.perf_counter()
+        genre_data = self.genre_data = self.load_genre_data()
+        if self.catalog is not None:
+            self.catalog.close()
+        self.catalog = LazyCatalog.open(self.file_path, self.genre_file_path, genre_data, progress)
+        self.artist_music = LazyArtistMusic(self.catalog)
+        self.music_features = LazyMusicFeatures(self.catalog)
+        reader = self.catalog.build_reader #set when the offset index had to be built from the csv
+        self.load_report = {
+            "source": "csv" if reader is not None else "offset index",
+            "rows": self.catalog.index.rows,
+            "skipped": self.catalog.index.skipped,
+            "skipped_ids": reader.skipped_ids if reader is not None else [],
+            "seconds": time.perf_counter() - start,
+        }
+        if progress is not None and reader is None:
+            size = os.path.getsize(self.file_path)
+            progress(self.catalog.index.rows, size, size)
+
+    #fold rows appended to data.csv since the last load or update into what is loaded. only the new lines are parsed,
+    #and everything already built from the data (statistics, feature indexes, artist profiles, normalizers) is
+    #updated with them instead of rebuilt. a rewritten file and lazy mode fall back to load_data. not thread safe:
+    #no query may run while it does
+    def update_data(self, progress=None):
+        start = time.perf_counter()
+        size = os.path.getsize(self.file_path)
+        if self.lazy or size < self.consumed_bytes or prefix_digest(self.file_path, self.consumed_bytes) != self.head_digest:
+            self.load_data(progress)
+            instrumentation.count("update_reloads")
+            self.update_report = {"reloaded": True, "rows": self.load_report.get("rows", 0),
+                                  "seconds": time.perf_counter() - start}
+            return self.update_report
+
+        first_byte = self.consumed_bytes
+        last_byte = complete_lines_end(self.file_path, first_byte) #a half written last line waits for the next update
+        reader = MusicCsvReader(self.file_path)
+        chunks = []
+        for chunk in reader.chunks(first_byte, last_byte):
+            if chunk.genres is not None:
+                chunk.genre_refs = [self.genre_data.refs_for_names(genre_names) for genre_names in chunk.genres]
+            chunks.append(chunk)
+            if progress is not None:
+                progress(reader.rows_parsed, first_byte + reader.bytes_read, last_byte)
+        self.consumed_bytes = last_byte
+        self.head_digest = prefix_digest(self.file_path, last_byte)
+        if reader.rows_parsed:
+            self.add_rows(chunks)
+        instrumentation.count("update_rows", reader.rows_parsed)
+
+        self.update_report = {
+            "reloaded": False,
+            "rows": reader.rows_parsed,
+            "skipped": reader.rows_skipped,
+            "skipped_ids": reader.skipped_ids,
+            "bytes": last_byte - first_byte,
+            "seconds": time.perf_counter() - start,
+        }
+        return self.update_report
+
+    def add_rows(self, chunks): #append parsed chunks to the loaded data and update what was built from it
+        genre_data = self.genre_data
+        artists = {} #artists credited on the new rows, first seen order
+        joined = [] #(track id, GenreRefs) of the new rows that join a genre, in file order
+        artist_entries = [] #features dict once per artist credit, what artist_music gains
+        for chunk in chunks:
+            for row, (track_id, track_key, credited, values) in enumerate(zip(
+                    chunk.ids, chunk.keys, chunk.artists, zip(*chunk.columns))):
+                artists.update(dict.fromkeys(credited))
+                features = dict(zip(FEATURE_NAMES, values))
+                artist_entries.extend(features for _ in credited)
+                if chunk.genre_refs is not None:
+                    refs = chunk.genre_refs[row]
+                else:
+                    refs = genre_data[track_key] if track_key and track_key in genre_data else None
+                if refs is not None:
+                    joined.append((track_id, refs))
+        track_ids = [track_id for track_id, _ in joined]
+        #a track id that is already there replaces its music_features value, that cannot be merged: the
+        #track side state is dropped and built again on next use
+        replaced = len(set(track_ids)) < len(track_ids) or any(track_id in self.music_features for track_id in track_ids)
+        artist_positions = self.artist_scan_positions(chunks) if "artist" in self.statistics else None
+
+        if self.store is not None:
+            builder = FeatureStoreBuilder()
+            for chunk in chunks:
+                builder.add_chunk(chunk)
+            first_row = len(self.store)
+            self.store = extend_store(self.store, builder.build())
+            self.artist_music.store = self.store #the views are updated in place, callers may hold them
+            self.music_features.add_rows(self.store, first_row)
+            self.normalizers.pop("store", None)
+        else:
+            for chunk in chunks:
+                self.add_chunk_to_dicts(chunk, genre_data)
+        self.recommender = None #its vectors and nearest neighbour indexes only cover the old rows
+        self.data_version += 1
+        self.result_cache.clear()
+
+        genre_rows = np.array([genre_id for _, refs in joined for genre_id in refs.ids], dtype=np.int64)
+        for kind in ("artist", "track"):
+            stats = self.statistics.get(kind)
+            if stats is None or not stats.feature_names or (kind == "track" and replaced):
+                self.statistics.pop(kind, None)
+            elif kind == "artist":
+                stats.merge(StreamingStatistics().add_entries(artist_entries, positions=artist_positions))
+            else: #genre entries are rows of the genre matrix, read them from there
+                stats.merge(StreamingStatistics().add_matrix(genre_data.matrix, genre_data.feature_names, rows=genre_rows))
+        for kind, keys in (("artist", list(artists)), ("track", list(dict.fromkeys(track_ids)))):
+            index = self.feature_indexes.get(kind)
+            if index is not None and ((kind == "track" and replaced) or not index.update(keys)):
+                del self.feature_indexes[kind]
+        for profiles in self.artist_profiles.values():
+            for chunk in chunks:
+                profiles.add_tracks(chunk.artists, np.array(chunk.columns, dtype=np.float64).reshape(len(FEATURE_NAMES), -1).T)
+        if "artist" in self.normalizers: #pooled moments of the updated profiles, nothing is read again
+            self.normalizers["artist"] = FeatureNormalizer.from_profiles(self.get_artist_profiles())
+        if "track" in self.normalizers:
+            if replaced:
+                del self.normalizers["track"]
+            else:
+                self.normalizers["track"].add_genre_refs(refs for _, refs in joined)
+
+    def artist_scan_positions(self, chunks):
+        #where every artist credit of chunks will sit in a scan of artist_music once they are added, (artist << SCAN_SHIFT) | entry.
+        #an existing artist's new tracks go after its old ones, new artists after all others
+        if self.store is not None:
+            lookup = self.store.artists.lookup()
+            sizes = np.diff(self.store.artist_offsets)
+            old_entries = lambda artist, index: int(sizes[index])
+        else:
+            lookup = {artist: index for index, artist in enumerate(self.artist_music)}
+            old_entries = lambda artist, index: len(self.artist_music[artist])
+        slots = {} #artist -> [artist index, next entry]
+        next_index = len(lookup)
+        positions = []
+        for chunk in chunks:
+            for credited in chunk.artists:
+                for artist in credited:
+                    slot = slots.get(artist)
+                    if slot is None:
+                        index = lookup.get(artist)
+                        if index is None:
+                            slot = [next_index, 0]
+                            next_index += 1
+                        else:
+                            slot = [index, old_entries(artist, index)]
+                        slots[artist] = slot
+                    positions.append(slot[0] << SCAN_SHIFT | slot[1])
+                    slot[1] += 1
+        return positions
 
     def get_music_features(self):
         return self.music_features
@@ -156,3 +441,75 @@ class MusicDataProcessor: # music data processor class to load data from data se
     def get_artist_music(self):
         return self.artist_music
 
+    def get_feature_store(self): #feature matrix for code that works on columns directly, None unless columnar=True
+        return self.store
+
+    def get_recommender(self): #top-k recommendations over the loaded data, rebuilt after every load and update
+        with self.build_lock:
+            if self.recommender is None:
+                if self.store is not None:
+                    # indexes are saved inside the snapshot directory, so a rebuilt snapshot never serves a stale index
+                    index_dir = SnapshotCache(self.file_path, self.genre_file_path).path if self.use_cache else None
+                    self.recommender = Recommender(self.store, index_dir, self.get_artist_profiles(), self.get_normalizer("store"),
+                                                   self.get_normalizer("artist"))
+                else: #dict and lazy mode: a feature matrix is packed from artist_music once, indexes stay in memory
+                    store = store_from_artist_music(self.artist_music)
+                    self.recommender = Recommender(store, None, self.get_artist_profiles(), FeatureNormalizer.from_store(store),
+                                                   self.get_normalizer("artist"))
+            return self.recommender
+
+    def get_artist_profiles(self, weighted=False): #per artist mean/variance/count over all of the artist's tracks
+        with self.build_lock:
+            if weighted not in self.artist_profiles:
+                if self.store is not None:
+                    self.artist_profiles[weighted] = ArtistProfiles.from_store(self.store, weighted)
+                elif self.lazy: #the entries' numbers in one pass over data.csv, no entry dicts
+                    values, offsets, _ = self.artist_music.entry_table()
+                    self.artist_profiles[weighted] = ArtistProfiles.from_entry_table(self.artist_music, values, offsets, FEATURE_NAMES, weighted)
+                else:
+                    self.artist_profiles[weighted] = ArtistProfiles.from_artist_music(self.artist_music, weighted)
+            return self.artist_profiles[weighted]
+
+    def get_normalizer(self, kind): #z-score parameters and standardized rows, built once per data_version
+        # "artist": artist profiles, "track": the genre features track similarity compares, "store": the feature matrix
+        with self.build_lock:
+            if kind not in self.normalizers:
+                if kind == "artist":
+                    self.normalizers[kind] = FeatureNormalizer.from_profiles(self.get_artist_profiles())
+                elif kind == "track":
+                    self.normalizers[kind] = FeatureNormalizer.from_genres(self.music_features, self.genre_data)
+                else:
+                    self.normalizers[kind] = FeatureNormalizer.from_store(self.store)
+            return self.normalizers[kind]
+
+    def get_statistics(self, kind): #calculate_statistics of artist_music ("artist") or music_features ("track"), kept current by update_data
+        with self.build_lock:
+            if kind not in self.statistics:
+                self.statistics[kind] = FeatureStatistics(self.artist_music if kind == "artist" else self.music_features).streaming_statistics()
+            return self.statistics[kind].results()
+
+    def get_feature_index(self, kind): #sorted per-feature index of artist_music ("artist") or music_features ("track")
+        with self.build_lock:
+            if kind not in self.feature_indexes:
+                self.feature_indexes[kind] = FeatureIndex(self.artist_music if kind == "artist" else self.music_features)
+            return self.feature_indexes[kind]
+
+    def query_similarity(self, kind, id1, id2, metric, normalize=True): #compute_similarity of two artists or tracks, metric by name, memoized
+        similarity_function = SIMILARITY_FUNCTIONS.get(metric)
+        if similarity_function is None:
+            raise ValueError(f"Invalid similarity metric {metric}.")
+
+        def compute():
+            data = self.get_artist_profiles() if kind == "artist" else self.music_features
+            normalizer = self.get_normalizer(kind) if normalize else None
+            return SimilarityMeasures.compute_similarity(data, id1, id2, similarity_function, normalizer=normalizer)
+        return self.result_cache.get_or_compute(similarity_key(self.data_version, kind, id1, id2, metric, normalize), compute)
+
+    def query_best_feature(self, kind, feature, criterion): #feature index lookup of the highest/lowest entry, memoized
+        return self.result_cache.get_or_compute(feature_key(self.data_version, kind, feature, criterion),
+                                                lambda: self.get_feature_index(kind).query_best_feature(feature, criterion))
+
+    def build_indexes(self):
+        for kind, metric in self.index_metrics:
+            self.get_recommender().build_index(kind, metric)
+
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote
+
+# load test for service.py: keeps `concurrency` keep-alive connections busy for `duration` seconds with a mix of
+# similarity, feature and top-k requests, then prints p50/p99 latency and requests/sec per endpoint
+
+METRICS = ("euclidean", "cosine", "pearson", "jaccard", "manhattan")
+FEATURES = ("valence", "energy", "danceability", "loudness", "tempo", "popularity")
+
+
+class Connection:  # one keep-alive HTTP/1.1 connection, requests are sent one after the other
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, target):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode("latin-1"))
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def make_request(rng, ids, artists, mix):
+    # (endpoint, target) of one random request
+    endpoint = rng.choices(list(mix), weights=list(mix.values()))[0]
+    if endpoint == "similarity":
+        if rng.random() < 0.5:
+            return endpoint, (f"/similarity?kind=track&id1={rng.choice(ids)}&id2={rng.choice(ids)}"
+                              f"&metric={rng.choice(METRICS)}")
+        first, second = rng.choice(artists), rng.choice(artists)
+        return endpoint, f"/similarity?kind=artist&id1={first}&id2={second}&metric={rng.choice(METRICS)}"
+    if endpoint == "feature":
+        return endpoint, (f"/feature?kind={rng.choice(('track', 'artist'))}&feature={rng.choice(FEATURES)}"
+                          f"&criterion={rng.choice(('highest', 'lowest'))}")
+    return endpoint, f"/top?kind=track&id={rng.choice(ids)}&k=10&metric={rng.choice(METRICS[:3])}"
+
+
+async def run(host, port, concurrency, duration, mix, seed):
+    setup = Connection(host, port)
+    _, tracks = await setup.get("/sample?kind=track&n=1000")
+    _, artists = await setup.get("/sample?kind=artist&n=1000")
+    setup.close()
+    ids = [quote(track_id) for track_id in tracks["ids"]]
+    artist_names = [quote(name) for name in artists["ids"]]
+    latencies = {endpoint: [] for endpoint in mix}
+    errors = {endpoint: 0 for endpoint in mix}
+    deadline = time.perf_counter() + duration
+
+    async def client(number):
+        rng = random.Random(seed + number)
+        connection = Connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                endpoint, target = make_request(rng, ids, artist_names, mix)
+                start = time.perf_counter()
+                status, _ = await connection.get(target)
+                latencies[endpoint].append((time.perf_counter() - start) * 1000)
+                errors[endpoint] += status >= 500  # 400s are expected, e.g. unknown artist names
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    report = {"concurrency": concurrency, "seconds": elapsed, "endpoints": {}}
+    everything = []
+    for endpoint, values in latencies.items():
+        values.sort()
+        everything.extend(values)
+        report["endpoints"][endpoint] = {"requests": len(values), "errors": errors[endpoint],
+                                         "rps": len(values) / elapsed, "p50_ms": percentile(values, 0.5),
+                                         "p99_ms": percentile(values, 0.99)}
+    everything.sort()
+    report.update({"requests": len(everything), "rps": len(everything) / elapsed,
+                   "p50_ms": percentile(everything, 0.5), "p99_ms": percentile(everything, 0.99)})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure latency and throughput of a running service.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--mix", default="similarity=8,feature=1,top=1", help="endpoint=weight,...")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    mix = {name: float(weight) for name, weight in (part.split("=") for part in args.mix.split(","))}
+    report = asyncio.run(run(args.host, args.port, args.concurrency, args.duration, mix, args.seed))
+    for endpoint, numbers in report["endpoints"].items():
+        print(f"{endpoint:<12} {numbers['requests']:>8} req {numbers['rps']:>9.1f} rps  "
+              f"p50 {numbers['p50_ms']:.2f} ms  p99 {numbers['p99_ms']:.2f} ms  errors {numbers['errors']}")
+    print(f"{'total':<12} {report['requests']:>8} req {report['rps']:>9.1f} rps  "
+          f"p50 {report['p50_ms']:.2f} ms  p99 {report['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,35 @@
+import queue
+import sys
+import threading
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, ttk
 from load_data_set import MusicDataProcessor
-from statistical_functions import FeatureStatistics
-from similarity_module import SimilarityMeasures
-
-# Function to determine similarity outcome based on the score
-def similarity_outcome(similarity):
-    if similarity == 1:
-        return "Highly Identical"
-    elif 0.8 <= similarity < 1:
-        return "Very Similar"
-    elif 0.6 <= similarity < 0.8:
-        return "Moderately Identical"
-    elif 0.4 <= similarity < 0.6:
-        return "Slightly Identical"
-    elif 0 < similarity < 0.4:
-        return "Not Identical"
-    else:
-        return "Completely Dissimilar"
+from similarity_module import SIMILARITY_FUNCTIONS, similarity_outcome
+
+POLL_MS = 50  # how often the Tk thread checks the queue for messages from worker threads
 
 class MusicAnalyticsApp:
-    def __init__(self, root):
+    def __init__(self, root, lazy=False):
         self.root = root
         self.root.title("Music Data Analytics Tool")
         self.root.geometry("1000x700")
 
-        # Load datasets
-        self.processor = MusicDataProcessor('dataset/data.csv', 'dataset/data_genres.csv')
-        self.processor.load_data()
+        # lazy: tracks stay in data.csv and are read on demand, for machines without memory for the whole catalog
+        self.processor = MusicDataProcessor('dataset/data.csv', 'dataset/data_genres.csv', use_cache=True, lazy=lazy)
+        self.music_features = {}
+        self.artist_music = {}
 
-        self.music_features = self.processor.get_music_features()
-        self.artist_music = self.processor.get_artist_music()
+        # worker threads never touch widgets, they put (message, job, payload) on this queue and the
+        # Tk thread picks it up in poll_results
+        self.results = queue.Queue()
+        self.jobs = {}  # job id -> (on_done, cancellable) of jobs still running, a cancelled job is just dropped
+        self.next_job = 0
 
-        # Create the main menu buttons
+        # Create the main menu buttons, the window shows up straight away and the data loads in the background
         self.create_main_menu()
+        self.create_status_bar()
+        self.start_loading()
+        self.root.after(POLL_MS, self.poll_results)
 
     def create_main_menu(self):
         # Title label
@@ -53,6 +49,100 @@ class MusicAnalyticsApp:
         self.exit_button = tk.Button(self.root, text="Exit", width=20, command=self.root.quit)
         self.exit_button.pack(pady=20)
 
+    def create_status_bar(self):
+        status_frame = tk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=20, pady=10)
+        self.progress = ttk.Progressbar(status_frame, mode="determinate", maximum=100)
+        self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_button = tk.Button(status_frame, text="Cancel", width=10, command=self.cancel_queries, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=10)
+        self.status_label = tk.Label(self.root, text="", anchor="w")
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X, padx=20)
+
+    def set_buttons(self, state):
+        for button in (self.query_button, self.similarity_button, self.track_similarity_button):
+            button.config(state=state)
+
+    def start_loading(self):
+        self.set_buttons(tk.DISABLED)
+        self.status_label.config(text="Loading dataset...")
+        self.submit(lambda: self.processor.load_data(progress=self.report_progress), self.loading_finished)
+
+    def report_progress(self, rows, bytes_read, total_bytes): # called on the loader thread
+        self.results.put(("progress", None, (rows, bytes_read, total_bytes)))
+
+    def loading_finished(self, _):
+        self.music_features = self.processor.get_music_features()
+        self.artist_music = self.processor.get_artist_music()
+        self.progress["value"] = 100
+        report = self.processor.load_report
+        self.status_label.config(text=f"Loaded {report.get('rows', 0)} tracks from {report.get('source', 'csv')} in {report.get('seconds', 0):.1f}s")
+        self.set_buttons(tk.NORMAL)
+
+    def submit(self, task, on_done, cancellable=False):
+        # run task on a daemon thread, on_done(result) is called later on the Tk thread
+        job = self.next_job
+        self.next_job += 1
+        self.jobs[job] = (on_done, cancellable)
+
+        def run():
+            try:
+                self.results.put(("done", job, task()))
+            except Exception as e:
+                self.results.put(("error", job, e))
+
+        threading.Thread(target=run, daemon=True).start()
+        if cancellable:
+            self.cancel_button.config(state=tk.NORMAL)
+            self.progress.config(mode="indeterminate")
+            self.progress.start()
+            self.status_label.config(text="Working...")
+        return job
+
+    def run_query(self, task, on_done):
+        self.submit(task, on_done, cancellable=True)
+
+    def cancel_queries(self):
+        # python threads cannot be stopped from outside, so a cancelled query is forgotten: the ui is free
+        # again right away and its result is thrown away when the thread finishes. the processor builds its
+        # shared structures under a lock, so a new query waits for one the cancelled query is still building
+        for job in [job for job, (_, cancellable) in self.jobs.items() if cancellable]:
+            del self.jobs[job]
+        self.query_finished()
+        self.status_label.config(text="Query cancelled")
+
+    def query_finished(self):
+        if not any(cancellable for _, cancellable in self.jobs.values()):
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress.stop()
+            self.progress.config(mode="determinate")
+            self.progress["value"] = 100
+            self.status_label.config(text="Ready")
+
+    def poll_results(self):
+        try:
+            while True:
+                message, job, payload = self.results.get_nowait()
+                if message == "progress":
+                    rows, bytes_read, total_bytes = payload
+                    self.progress["value"] = 100 * bytes_read / total_bytes if total_bytes else 100
+                    self.status_label.config(text=f"Loading dataset... {rows} tracks read")
+                    continue
+                if job not in self.jobs:  # cancelled
+                    continue
+                on_done, cancellable = self.jobs.pop(job)
+                if cancellable:
+                    self.query_finished()
+                if message == "error":
+                    if not cancellable:
+                        self.status_label.config(text=f"Loading failed: {payload}")
+                    messagebox.showerror("Error", f"Error: {payload}")
+                else:
+                    on_done(payload)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_MS, self.poll_results)
+
     def query_statistics(self):
         stat_window = tk.Toplevel(self.root)
         stat_window.title("Query Statistics")
@@ -81,14 +171,11 @@ class MusicAnalyticsApp:
             choice = stat_choice.get()
 
             if feature and query_type:
-                if choice == "1":
-                    feature_obj = FeatureStatistics(self.artist_music)
-                    result = feature_obj.query_best_feature(feature, query_type)
-                    messagebox.showinfo("Query Result", f"Result: {result}")
-                elif choice == "2":
-                    feature_obj = FeatureStatistics(self.music_features)
-                    result = feature_obj.query_best_feature(feature, query_type)
-                    messagebox.showinfo("Query Result", f"Result: {result}")
+                # the feature index is built once per loaded dataset, every query after that is a lookup.
+                # the first one builds it, so it runs on a worker thread
+                kind = "artist" if choice == "1" else "track"
+                self.run_query(lambda: self.processor.query_best_feature(kind, feature, query_type),
+                               lambda result: messagebox.showinfo("Query Result", f"Result: {result}"))
             else:
                 messagebox.showerror("Error", "Please fill in all fields.")
 
@@ -123,24 +210,14 @@ class MusicAnalyticsApp:
         metric = self.metric_choice.get()
 
         if artist1 and artist2 and metric:
-            similarity_function = {
-                "Euclidean": SimilarityMeasures.euclidean_similarity,
-                "Cosine": SimilarityMeasures.cosine_similarity,
-                "Pearson": SimilarityMeasures.pearson_similarity,
-                "Jaccard": SimilarityMeasures.jaccard_similarity,
-                "Manhattan": SimilarityMeasures.manhattan_similarity,
-            }.get(metric)
-
-            if not similarity_function:
+            if metric.lower() not in SIMILARITY_FUNCTIONS:
                 messagebox.showerror("Error", "Invalid similarity metric.")
                 return
 
-            try:
-                similarity = SimilarityMeasures.compute_similarity(self.artist_music, artist1, artist2, similarity_function)
-                result = similarity_outcome(similarity)
-                messagebox.showinfo("Similarity Result", f"Similarity: {similarity:.4f}\nOutcome: {result}")
-            except ValueError as e:
-                messagebox.showerror("Error", f"Error: {e}")
+            # artists are compared on their profile, the mean of all their tracks, not just the first one.
+            # a ValueError for an unknown name comes back through poll_results as an error message
+            self.run_query(lambda: self.processor.query_similarity("artist", artist1, artist2, metric.lower()),
+                           self.show_similarity)
         else:
             messagebox.showerror("Error", "Please fill in all fields.")
 
@@ -172,28 +249,21 @@ class MusicAnalyticsApp:
         metric = self.track_metric_choice.get()
 
         if track_id1 and track_id2 and metric:
-            similarity_function = {
-                "Euclidean": SimilarityMeasures.euclidean_similarity,
-                "Cosine": SimilarityMeasures.cosine_similarity,
-                "Pearson": SimilarityMeasures.pearson_similarity,
-                "Jaccard": SimilarityMeasures.jaccard_similarity,
-                "Manhattan": SimilarityMeasures.manhattan_similarity,
-            }.get(metric)
-
-            if not similarity_function:
+            if metric.lower() not in SIMILARITY_FUNCTIONS:
                 messagebox.showerror("Error", "Invalid similarity metric.")
                 return
 
-            try:
-                similarity = SimilarityMeasures.compute_similarity(self.music_features, track_id1, track_id2, similarity_function)
-                result = similarity_outcome(similarity)
-                messagebox.showinfo("Similarity Result", f"Similarity: {similarity:.4f}\nOutcome: {result}")
-            except ValueError as e:
-                messagebox.showerror("Error", f"Error: {e}")
+            # z-scored features, so duration_ms, tempo and loudness no longer outweigh the 0-1 features
+            self.run_query(lambda: self.processor.query_similarity("track", track_id1, track_id2, metric.lower()),
+                           self.show_similarity)
         else:
             messagebox.showerror("Error", "Please fill in all fields.")
 
+    def show_similarity(self, similarity):
+        result = similarity_outcome(similarity)
+        messagebox.showinfo("Similarity Result", f"Similarity: {similarity:.4f}\nOutcome: {result}")
+
 if __name__ == "__main__":
     root = tk.Tk()
-    app = MusicAnalyticsApp(root)
+    app = MusicAnalyticsApp(root, lazy="--lazy" in sys.argv)
     root.mainloop()
@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from genre_table import SharedGroups
+
+
+def zscore_parameters(matrix, weights=None):
+    # column mean and population std, the same numbers FeatureStatistics.calculate_statistics gives.
+    # weights counts how often each row occurs in the data the statistics are meant for
+    mean = np.average(matrix, axis=0, weights=weights)
+    std = np.sqrt(np.average((matrix - mean) ** 2, axis=0, weights=weights))
+    return mean, std
+
+
+def zscore(matrix, mean, std):
+    # same rule as FeatureStatistics.normalize_features, a feature without variance becomes 0
+    safe_std = np.where(std > 0, std, 1.0)
+    return np.where(std > 0, (matrix - mean) / safe_std, 0.0)
+
+
+class FeatureNormalizer:  # z-score mean/std of one dataset plus its rows already standardized, built once per data_version
+    def __init__(self, feature_names, matrix, mean, std, positions=None):
+        self.feature_names = tuple(feature_names)
+        self.mean = mean
+        self.std = std
+        self.matrix = zscore(np.asarray(matrix, dtype=np.float64), mean, std)  # standardized copy, one row per item
+        self.positions = positions  # key -> row of matrix, what features(key) looks up
+        self._rows = {}  # row -> standardized features dict, made on first use and handed out again after that
+
+    @classmethod
+    def from_matrix(cls, matrix, feature_names, positions=None, weights=None):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        mean, std = zscore_parameters(matrix, weights) if len(matrix) else (np.zeros(matrix.shape[1]),) * 2
+        return cls(feature_names, matrix, mean, std, positions)
+
+    @classmethod
+    def from_store(cls, store):
+        # the feature matrix the recommender and pairwise jobs score, one row per track
+        return cls.from_matrix(store.matrix, store.feature_names, store.ids.lookup())
+
+    @classmethod
+    def from_profiles(cls, profiles):
+        # artist mean profiles, standardized with the moments of all artist tracks pooled together
+        # (what calculate_statistics over artist_music gives) so no second pass over the tracks is needed
+        total = profiles.totals.sum()
+        if not total:
+            mean = std = np.zeros(len(profiles.feature_names))
+        else:
+            mean = profiles.totals @ profiles.means / total
+            spread = profiles.m2.sum(axis=0) + profiles.totals @ (profiles.means - mean) ** 2
+            std = np.sqrt(spread / total)
+        return cls(profiles.feature_names, profiles.means, mean, std, profiles.positions)
+
+    @classmethod
+    def from_genres(cls, music_features, genre_table):
+        # genre features the track comparison reads, every genre weighted by how many tracks join to it
+        # like calculate_statistics over music_features would. tracks sharing one GenreRefs are counted together
+        groups = SharedGroups.of(music_features)
+        weights = np.zeros(len(genre_table.names))
+        for refs, count in zip(groups.items, groups.counts()):
+            np.add.at(weights, list(refs.ids), count)
+        normalizer = cls.from_matrix(genre_table.matrix, genre_table.feature_names,
+                                     FirstGenrePositions(music_features), weights if weights.any() else None)
+        normalizer.source = genre_table.matrix
+        normalizer.weights = weights  # kept so add_genre_refs can count tracks joined later
+        return normalizer
+
+    def add_genre_refs(self, refs_list):
+        # tracks that joined genres after from_genres: count them and take mean/std again over the genre rows,
+        # the cost depends on the new tracks and the number of genres, not on the catalog
+        for refs in refs_list:
+            np.add.at(self.weights, list(refs.ids), 1)
+        self.refit(self.source, self.weights if self.weights.any() else None)
+
+    def refit(self, matrix, weights=None):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        self.mean, self.std = zscore_parameters(matrix, weights)
+        self.matrix = zscore(matrix, self.mean, self.std)
+        self._rows = {}
+
+    def row(self, row):
+        features = self._rows.get(row)
+        if features is None:
+            features = self._rows[row] = dict(zip(self.feature_names, self.matrix[row].tolist()))
+        return features
+
+    def features(self, key):
+        # standardized features of one artist / track id, the same dict object on every call
+        return self.row(self.positions[key])
+
+    def apply(self, matrix):
+        # standardize other rows with this dataset's mean and std
+        return zscore(np.asarray(matrix, dtype=np.float64), self.mean, self.std)
+
+    def stats(self):
+        # the parameters in the shape FeatureStatistics.normalize_features takes
+        return {feature: {"mean": float(mean), "std_dev": float(std)}
+                for feature, mean, std in zip(self.feature_names, self.mean, self.std)}
+
+
+class FirstGenrePositions(Mapping):  # track id -> genre id of the track's first genre, the entry compute_similarity compares
+    def __init__(self, music_features):
+        self.music_features = music_features
+
+    def __getitem__(self, track_id):
+        return self.music_features[track_id].ids[0]
+
+    def __iter__(self):
+        return iter(self.music_features)
+
+    def __len__(self):
+        return len(self.music_features)
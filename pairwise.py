@@ -0,0 +1,134 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from recommendation import similarity_scores
+
+PAIRWISE_METRICS = ("euclidean", "manhattan", "cosine", "pearson", "jaccard")
+MEMORY_LIMIT = 256 << 20  # default bound for the temporary tile arrays of all workers together
+
+_shared = {}  # worker side: the prepared vectors, opened once per process from the temporary .npy file
+
+
+def prepare_vectors(vectors, metric):
+    # turn cosine and pearson into plain dot products: unit rows for cosine, centered unit rows for pearson
+    vectors = np.asarray(vectors, dtype=np.float64)
+    if metric == "pearson":
+        vectors = vectors - vectors.mean(axis=1, keepdims=True)
+    if metric in ("cosine", "pearson"):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+    return np.ascontiguousarray(vectors)
+
+
+def tile_scores(rows, columns, metric, row_squares=None, column_squares=None):
+    # similarity of every row against every column of one tile, matmul based where the metric allows it
+    if metric in ("cosine", "pearson"):
+        return rows @ columns.T
+    if metric == "euclidean":
+        squared = row_squares[:, None] + column_squares[None, :] - 2.0 * (rows @ columns.T)
+        return 1.0 / (1.0 + np.sqrt(np.clip(squared, 0, None)))
+    if metric == "manhattan":
+        return similarity_scores(rows, columns, metric)
+    # jaccard compares feature name sets, every vector here has the same features
+    return np.ones((rows.shape[0], columns.shape[0]))
+
+
+def tile_size(count, dimensions, metric, memory_limit, workers):
+    # rows and columns per tile so all workers' temporaries stay under memory_limit
+    per_worker = max(1 << 20, memory_limit // max(1, workers))
+    cell_bytes = 8 * (dimensions + 2 if metric == "manhattan" else 3)
+    side = int((per_worker / cell_bytes) ** 0.5)
+    return max(1, min(count, side))
+
+
+def share_vectors(vectors):
+    _shared["vectors"] = vectors
+    _shared["squares"] = np.einsum("nd,nd->n", vectors, vectors)
+
+
+def init_worker(vectors_path):
+    share_vectors(np.load(vectors_path, mmap_mode="r"))
+
+
+def score_block(task):
+    # one block of rows against all columns, tile by tile. writes into the memmap or returns the top k per row
+    start, end, metric, tile, out_path, k, include_self = task
+    vectors, squares = _shared["vectors"], _shared["squares"]
+    count = vectors.shape[0]
+    rows = np.asarray(vectors[start:end])
+    output = np.memmap(out_path, dtype=np.float32, mode="r+", shape=(count, count)) if out_path else None
+    best_rows = best_scores = None
+    for column_start in range(0, count, tile):
+        column_end = min(count, column_start + tile)
+        scores = tile_scores(rows, np.asarray(vectors[column_start:column_end]), metric,
+                             squares[start:end], squares[column_start:column_end])
+        if output is not None:
+            output[start:end, column_start:column_end] = scores
+            continue
+        if not include_self:
+            for row in range(max(start, column_start), min(end, column_end)):
+                scores[row - start, row - column_start] = -np.inf
+        columns = np.arange(column_start, column_end)
+        candidates = np.broadcast_to(columns, scores.shape)
+        if best_rows is not None:  # keep only the best k seen so far next to the new tile
+            scores = np.hstack([best_scores, scores])
+            candidates = np.hstack([best_rows, candidates])
+        keep = min(k, scores.shape[1])
+        picked = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+        best_rows = np.take_along_axis(candidates, picked, axis=1)
+        best_scores = np.take_along_axis(scores, picked, axis=1)
+    if output is not None:
+        output.flush()
+        return start, None, None
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return start, np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def pairwise_similarity(vectors, metric="cosine", out_path=None, k=None, memory_limit=MEMORY_LIMIT, workers=None,
+                        include_self=False):
+    # all-pairs similarity of vectors, computed in tiles spread over a process pool. give out_path to get the
+    # full matrix as a float32 memmap on disk, or k to get (rows, scores) of the k most similar per row
+    metric = metric.lower()
+    if metric not in PAIRWISE_METRICS:
+        raise ValueError(f"Unsupported similarity metric {metric}, choose one of {', '.join(PAIRWISE_METRICS)}.")
+    if (out_path is None) == (k is None):
+        raise ValueError("Give either out_path for the full matrix or k for the top k per row.")
+    prepared = prepare_vectors(vectors, metric)
+    count = prepared.shape[0]
+    if k is not None:
+        k = max(1, min(k, count - (0 if include_self else 1)))
+    workers = workers or os.cpu_count() or 1
+    tile = tile_size(count, prepared.shape[1], metric, memory_limit, workers)
+    if out_path is not None:
+        np.memmap(out_path, dtype=np.float32, mode="w+", shape=(count, count)).flush()
+    tasks = [(start, min(count, start + tile), metric, tile, out_path, k, include_self)
+             for start in range(0, count, tile)]
+    if workers == 1:  # scored right from prepared in this process, nothing to write out and map
+        share_vectors(prepared)
+        try:
+            results = [score_block(task) for task in tasks]
+        finally:
+            _shared.clear()
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            vectors_path = os.path.join(folder, "vectors.npy")
+            np.save(vectors_path, prepared)  # workers memory map this instead of receiving a pickled copy
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(vectors_path,)) as pool:
+                results = list(pool.map(score_block, tasks))
+    if out_path is not None:
+        return np.memmap(out_path, dtype=np.float32, mode="r", shape=(count, count))
+    neighbours = np.zeros((count, k), dtype=np.int64)
+    scores = np.zeros((count, k))
+    for start, block_rows, block_scores in results:
+        neighbours[start:start + len(block_rows)] = block_rows
+        scores[start:start + len(block_rows)] = block_scores
+    return neighbours, scores
+
+
+def genre_track_rows(store, music_features, genre_name):
+    # store rows of the tracks joined to one genre, for pairwise jobs within a genre
+    return np.array([store.row_of(track_id) for track_id, genres in music_features.items()
+                     if any(entry["genre_name"] == genre_name for entry in genres)], dtype=np.int64)
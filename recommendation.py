@@ -0,0 +1,166 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+from ann_index import INDEX_TYPES, load_index
+from artist_profiles import ArtistProfiles
+from normalization import FeatureNormalizer
+
+METRICS = ("euclidean", "manhattan", "cosine", "pearson")  # metrics that can be scored against the whole catalog at once
+BLOCK_BYTES = 64 << 20  # upper bound for the temporary difference arrays of euclidean/manhattan batches
+
+
+def similarity_scores(queries, catalog, metric):
+    # (q, d) queries against (n, d) catalog -> (q, n) scores, same formulas as SimilarityMeasures
+    queries = np.atleast_2d(queries)
+    if metric in ("euclidean", "manhattan"):
+        scores = np.empty((queries.shape[0], catalog.shape[0]))
+        step = max(1, BLOCK_BYTES // max(1, catalog.size * catalog.itemsize))
+        for start in range(0, queries.shape[0], step):
+            diff = queries[start:start + step, None, :] - catalog[None, :, :]
+            if metric == "euclidean":
+                distance = np.sqrt(np.einsum("qnd,qnd->qn", diff, diff))
+            else:
+                distance = np.abs(diff).sum(axis=2)
+            scores[start:start + step] = 1.0 / (1.0 + distance)
+        return scores
+    if metric == "cosine":
+        dot = queries @ catalog.T
+        norms = np.outer(np.linalg.norm(queries, axis=1), np.linalg.norm(catalog, axis=1))
+        return np.divide(dot, norms, out=np.zeros_like(dot), where=norms != 0)
+    if metric == "pearson":
+        n = queries.shape[1]
+        sum_q = queries.sum(axis=1)
+        sum_c = catalog.sum(axis=1)
+        numerator = queries @ catalog.T - np.outer(sum_q, sum_c) / n
+        spread_q = (queries * queries).sum(axis=1) - sum_q ** 2 / n
+        spread_c = (catalog * catalog).sum(axis=1) - sum_c ** 2 / n
+        denominator = np.sqrt(np.clip(np.outer(spread_q, spread_c), 0, None))
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+    raise ValueError(f"Unsupported similarity metric {metric}, choose one of {', '.join(METRICS)}.")
+
+
+def top_k(scores, k, exclude=None):
+    # best k columns of one row of scores, highest first. argpartition keeps it O(n) instead of a full sort
+    if exclude is not None:
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+    k = min(k, scores.shape[0] - (0 if exclude is None else np.size(exclude)))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+class Recommender:  # top-k most similar tracks or artists, scoring the query against the whole catalog in one pass
+    def __init__(self, store, index_dir=None, profiles=None, normalizer=None, artist_normalizer=None):
+        self.store = store
+        self.normalizer = normalizer  # FeatureNormalizer of the store, shared with the data processor's cache
+        # FeatureNormalizer of the artist profiles, the one query_similarity("artist") uses, so both score alike
+        self.artist_normalizer = artist_normalizer
+        self.profiles = profiles  # ArtistProfiles the artist vectors come from, built from the store when missing
+        self.index_dir = index_dir  # where built indexes are saved and looked for, None keeps them in memory only
+        self._vectors = {}  # (kind, normalize) -> matrix the queries are scored against
+        self.indexes = {}  # (kind, metric, normalize) -> approximate nearest neighbour index
+
+    def vectors(self, kind, normalize):
+        cache_key = (kind, normalize)
+        if cache_key not in self._vectors:
+            matrix = np.asarray(self.store.matrix, dtype=np.float64)
+            if normalize and kind == "track" and self.normalizer is None:
+                self.normalizer = FeatureNormalizer.from_store(self.store)
+            if kind == "artist":
+                if self.profiles is None:
+                    self.profiles = ArtistProfiles.from_store(self.store)
+                matrix = self.profiles.means  # each artist's mean features over all its tracks
+                if normalize:
+                    if self.artist_normalizer is None:
+                        self.artist_normalizer = FeatureNormalizer.from_profiles(self.profiles)
+                    matrix = self.artist_normalizer.matrix  # the profile means, already standardized
+            elif normalize:
+                matrix = self.normalizer.matrix  # already standardized once for this data version
+            self._vectors[cache_key] = matrix
+        return self._vectors[cache_key]
+
+    def build_index(self, kind="track", metric="euclidean", normalize=True):
+        # kd-tree for euclidean/manhattan, random projection lsh for cosine/pearson. reuses a saved index
+        # when it was built from exactly the same vectors
+        metric = metric.lower()
+        if metric not in INDEX_TYPES:
+            raise ValueError(f"Unsupported similarity metric {metric}, choose one of {', '.join(METRICS)}.")
+        vectors = self.vectors(kind, normalize)
+        path = None
+        index = None
+        if self.index_dir is not None:
+            digest = hashlib.blake2b(np.ascontiguousarray(vectors).tobytes(), digest_size=8).hexdigest()
+            path = os.path.join(self.index_dir, f"index-{kind}-{metric}-{'z' if normalize else 'raw'}-{digest}.npz")
+            try:
+                index = load_index(path, metric)
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                index = None  # missing, partly written or damaged, built again and saved over it
+            if index is not None and index.size != vectors.shape[0]:
+                index = None
+        if index is None:
+            index = INDEX_TYPES[metric](vectors)
+            if path is not None:
+                index.save(path)
+        self.indexes[(kind, metric, normalize)] = index
+        return index
+
+    def labels(self, kind):
+        if kind == "artist":
+            self.vectors(kind, False)  # makes sure the profiles exist
+            return ArtistLabels(self.profiles)
+        return self.store.ids
+
+    def position(self, kind, query_id):
+        lookup = self.labels(kind).lookup()
+        if query_id not in lookup:
+            name = "Artist Name" if kind == "artist" else "Track ID"
+            raise ValueError(f"{name} {query_id} not found in the dataset.")
+        return lookup[query_id]
+
+    def most_similar(self, ids, k=10, metric="euclidean", normalize=True, kind="track", exact=True, effort=None):
+        # ids is one track id / artist name or a list of them, returns [(id, score), ...] or one such list per query.
+        # exact=False answers from the index built with build_index, effort trades recall for latency: leaves scanned
+        # for euclidean/manhattan, multi-probe radius in bits for cosine/pearson, None is exact search for both
+        metric = metric.lower()
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported similarity metric {metric}, choose one of {', '.join(METRICS)}.")
+        single = isinstance(ids, str)
+        queries = [ids] if single else list(ids)
+        positions = [self.position(kind, query_id) for query_id in queries]
+        matrix = self.vectors(kind, normalize)
+        labels = self.labels(kind)
+        results = []
+        if not exact:
+            index = self.indexes.get((kind, metric, normalize)) or self.build_index(kind, metric, normalize)
+            for position in positions:
+                rows, values = index.query(matrix[position], k, effort, exclude=position)
+                scores = values if metric in ("cosine", "pearson") else 1.0 / (1.0 + values)
+                results.append([(labels[row], float(score)) for row, score in zip(rows.tolist(), scores.tolist())])
+            return results[0] if single else results
+        step = max(1, BLOCK_BYTES // max(1, matrix.shape[0] * 8))  # queries scored together, bounds the score block
+        for start in range(0, len(positions), step):
+            block = positions[start:start + step]
+            scores = similarity_scores(matrix[block], matrix, metric)
+            for row, position in enumerate(block):
+                best = top_k(scores[row], k, exclude=position)
+                results.append([(labels[index], float(scores[row, index])) for index in best.tolist()])
+        return results[0] if single else results
+
+
+class ArtistLabels:  # position <-> artist name over ArtistProfiles, same interface as a StringTable
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    def __getitem__(self, position):
+        return self.profiles.names[position]
+
+    def __len__(self):
+        return len(self.profiles.names)
+
+    def lookup(self):
+        return self.profiles.positions
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+import instrumentation
+
+# memoized answers of similarity and best feature queries. a key holds the data_version the answer was computed
+# for, so an answer of older data is never returned, and the processor clears the cache on every load and update
+# so those entries do not sit there until they are evicted
+
+DEFAULT_ENTRIES = 100000  # answers are a float or one small dict, this stays a few tens of MB at most
+
+# every SimilarityMeasures metric gives the same value for (a, b) and (b, a), so both orders share one entry
+SYMMETRIC_METRICS = frozenset(("euclidean", "cosine", "pearson", "jaccard", "manhattan"))
+
+
+def similarity_key(data_version, kind, id1, id2, metric, normalize):
+    if metric in SYMMETRIC_METRICS and id2 < id1:
+        id1, id2 = id2, id1
+    return ("similarity", data_version, kind, id1, id2, metric, bool(normalize))
+
+
+def feature_key(data_version, kind, feature, criterion):
+    return ("feature", data_version, kind, feature, criterion)
+
+
+class ResultCache:  # size bounded LRU of query answers with hit, miss and eviction counts
+    def __init__(self, max_entries=DEFAULT_ENTRIES):
+        self.max_entries = max_entries  # 0 turns the cache off, every lookup computes
+        self.entries = OrderedDict()  # key -> answer, least recently used first
+        self.lock = threading.Lock()  # the service answers queries on a thread pool
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                instrumentation.count("result_cache_hits")
+                return self.entries[key]
+            self.misses += 1
+        instrumentation.count("result_cache_misses")
+        # computed outside the lock so a slow query does not hold up the others. an error (unknown id, bad
+        # feature) raises before anything is stored, so it is computed again next time
+        result = compute()
+        if self.max_entries > 0:
+            with self.lock:
+                self.entries[key] = result
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+                    instrumentation.count("result_cache_evictions")
+        return result
+
+    def clear(self):  # drops the entries, the counters keep counting across loads
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
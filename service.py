@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from batch_cli import answer, json_value, prepare
+from load_data_set import MusicDataProcessor
+
+# small HTTP/1.1 + JSON server on asyncio streams, no framework needed. parameters come from the query string
+# and/or a JSON body:
+#   GET /similarity?kind=artist&id1=..&id2=..&metric=cosine     one pair, any of the five SimilarityMeasures metrics
+#   GET /feature?kind=track&feature=energy&criterion=highest    query_best_feature
+#   GET /top?kind=track&id=..&k=10&metric=euclidean&exact=1     most similar tracks / artists from the Recommender
+#   GET /sample?kind=track&n=100                                random ids, for load tests
+#   GET /metrics                                                request counts and latency histograms per endpoint,
+#                                                               result cache hits, misses and evictions
+# the two track endpoints compare different vectors, so their scores for the same pair differ: /similarity keeps
+# the GUI's meaning (the features of the first genre joined to each track, as compute_similarity reads
+# music_features), /top ranks on each track's own audio features from data.csv. artists use profiles in both
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # upper bounds, one more bucket above
+MAX_BODY = 1 << 20
+
+
+class LatencyHistogram:  # request latencies counted into fixed buckets, cheap to update and to report
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def record(self, milliseconds, error=False):
+        self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+        self.total += 1
+        self.sum_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+        self.errors += error
+
+    def percentile(self, fraction):
+        # upper bound of the bucket the percentile falls in, so the reported value is never too optimistic
+        if not self.total:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.bounds + (self.max_ms,), self.counts):
+            seen += count
+            if seen >= fraction * self.total:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def report(self):
+        return {
+            "count": self.total,
+            "errors": self.errors,
+            "mean_ms": self.sum_ms / self.total if self.total else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "buckets": {f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)}
+                       | {"inf": self.counts[-1]},
+        }
+
+
+class RecommendationService:  # the loaded dataset plus the request handlers, cpu work runs on a thread pool
+    def __init__(self, processor, workers=4, normalize=True):
+        self.processor = processor
+        self.normalize = normalize
+        self.executor = ThreadPoolExecutor(workers)  # numpy releases the GIL for the heavy parts of top-k
+        self.histograms = {}  # path -> LatencyHistogram
+        self.started = time.time()
+        self.routes = {
+            "/similarity": self.similarity,
+            "/feature": self.feature,
+            "/top": self.top,
+            "/sample": self.sample,
+        }
+
+    def similarity(self, params):
+        return answer(self.processor, {**params, "kind": params.get("kind", "track")}, self.normalize)
+
+    def feature(self, params):
+        if "feature" not in params:
+            raise ValueError("feature is required.")
+        return answer(self.processor, params, self.normalize)
+
+    def top(self, params):
+        kind = params.get("kind", "track")
+        k = int(params.get("k", 10))
+        exact = str(params.get("exact", "1")).lower() not in ("0", "false", "no")
+        effort = int(params["effort"]) if "effort" in params else None
+        results = self.processor.get_recommender().most_similar(
+            params["id"], k, params.get("metric", "euclidean"), self.normalize, kind, exact, effort)
+        return {"results": [{"id": label, "similarity": score} for label, score in results]}
+
+    def sample(self, params):
+        labels = self.processor.get_recommender().labels(params.get("kind", "track"))
+        n = min(int(params.get("n", 100)), len(labels))
+        return {"ids": [labels[position] for position in random.sample(range(len(labels)), n)]}
+
+    def metrics(self):
+        return {
+            "uptime_sec": time.time() - self.started,
+            "data_version": self.processor.data_version,
+            "result_cache": self.processor.result_cache.stats(),
+            "endpoints": {path: histogram.report() for path, histogram in sorted(self.histograms.items())},
+        }
+
+    async def dispatch(self, method, target, body):
+        # (status, payload) for one request
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            return 200, self.metrics()
+        handler = self.routes.get(url.path)
+        if handler is None:
+            return 404, {"error": f"Unknown endpoint {url.path}."}
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                params.update(json.loads(body))
+            except (ValueError, TypeError) as e:
+                return 400, {"error": f"Invalid JSON body: {e}"}
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, handler, params)
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        return 200, result
+
+    async def handle_connection(self, reader, writer):
+        # keep-alive loop: one request after another on the same connection until the client closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Bad request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:  # without a usable length the body cannot be skipped, so the connection ends here
+                    await self.respond(writer, 400, {"error": "Invalid Content-Length."}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except Exception as e:  # keep serving, the client gets a 500
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                await self.respond(writer, status, payload, keep_alive)
+                path = urlsplit(target).path
+                if path not in self.routes and path != "/metrics":
+                    path = "other"  # unknown paths share one histogram so clients cannot grow the table
+                if path not in self.histograms:
+                    self.histograms[path] = LatencyHistogram()
+                self.histograms[path].record((time.perf_counter() - start) * 1000, status >= 400)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=json_value).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+
+def load_processor(data, genres, normalize=True):
+    # everything the handlers read is built here, before the first request, so worker threads only read it
+    processor = MusicDataProcessor(data, genres, columnar=True, use_cache=True)
+    processor.load_data()
+    prepare(processor, normalize)
+    recommender = processor.get_recommender()
+    for kind in ("track", "artist"):
+        recommender.vectors(kind, normalize)
+        recommender.labels(kind).lookup()
+    return processor
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON similarity and statistics service.")
+    parser.add_argument("--data", default="dataset/data.csv")
+    parser.add_argument("--genres", default="dataset/data_genres.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="threads for the cpu bound part of requests")
+    parser.add_argument("--raw", action="store_true", help="compare raw features instead of z-scored ones")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    processor = load_processor(args.data, args.genres, not args.raw)
+    print(f"loaded {len(processor.get_feature_store())} tracks in {time.perf_counter() - start:.2f}s")
+    try:
+        asyncio.run(serve(RecommendationService(processor, args.workers, not args.raw), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
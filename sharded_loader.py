@@ -0,0 +1,134 @@
+import os
+from multiprocessing import get_context
+
+import numpy as np
+
+from csv_ingest import MusicCsvReader
+from feature_store import FeatureStoreBuilder, StringTable, pack_store
+
+# parallel loading of data.csv. the file is cut into byte ranges that start right after a newline, each range is
+# parsed in its own process and the pieces are merged in file order.
+# newline is the record boundary the serial loader uses as well: it reads the file line by line and the quote
+# state of split_line starts fresh on every line, so a quoted artist list or title never spans two records there.
+# cutting at newlines therefore gives every shard exactly the lines, and so the records, a serial load would see
+
+SHARDS_PER_WORKER = 4  # more shards than workers evens out uneven shards and gives steadier progress
+
+_genre_table = None  # worker side, set once per process by init_worker
+
+
+def header_end(path):
+    with open(path, "rb") as file:
+        file.readline()
+        return file.tell()
+
+
+def shard_ranges(path, shards):
+    # (start, end) byte ranges covering every line after the header, each starting right after a newline
+    size = os.path.getsize(path)
+    first = header_end(path)
+    bounds = [first]
+    with open(path, "rb") as file:
+        for shard in range(1, shards):
+            target = first + (size - first) * shard // shards
+            if target <= bounds[-1]:
+                continue
+            file.seek(target - 1)
+            file.readline()  # finish the line byte target - 1 belongs to
+            position = file.tell()
+            if bounds[-1] < position < size:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+class ShardResult:  # what one worker sends back for one byte range
+    def __init__(self, start, end, rows_parsed, rows_skipped, skipped_ids, store=None, chunks=None):
+        self.start = start
+        self.end = end
+        self.rows_parsed = rows_parsed
+        self.rows_skipped = rows_skipped
+        self.skipped_ids = skipped_ids
+        self.store = store  # columnar: a ColumnarFeatureStore of just this range, compact arrays and string blobs
+        self.chunks = chunks  # dict mode: the parsed MusicChunks, turned into dicts by the parent in order
+
+
+def init_worker(genre_table):
+    global _genre_table
+    _genre_table = genre_table
+
+
+def parse_shard(task):
+    path, start, end, chunk_rows, columnar = task
+    reader = MusicCsvReader(path, chunk_rows)
+    builder = FeatureStoreBuilder() if columnar else None
+    chunks = []
+    for chunk in reader.chunks(start, end):
+        if builder is None:
+            chunks.append(chunk)  # genres are resolved by the parent, so every GenreRefs points at its table
+            continue
+        if chunk.genres is not None:
+            chunk.genre_refs = [_genre_table.refs_for_names(genre_names) for genre_names in chunk.genres]
+        builder.add_chunk(chunk)
+    return ShardResult(start, end, reader.rows_parsed, reader.rows_skipped, reader.skipped_ids,
+                       builder.build() if builder is not None else None, None if columnar else chunks)
+
+
+def merge_stores(stores):
+    # one store equal to what a serial FeatureStoreBuilder makes: keys and artists get global codes in first seen
+    # order (shard by shard, each shard's own table is already in first seen order), rows are offset, and the
+    # stable sort in pack_store keeps every artist's tracks in file order
+    key_codes = {}
+    artist_codes = {}
+    keys, pair_artists, pair_rows, genre_counts, genre_ids = [], [], [], [], []
+    row_offset = 0
+    for store in stores:
+        key_map = np.array([key_codes.setdefault(label, len(key_codes)) for label in store.key_labels] + [-1],
+                           dtype=np.int16)  # the extra -1 at the end maps "no key" to itself
+        keys.append(key_map[store.keys])
+        artist_map = np.array([artist_codes.setdefault(artist, len(artist_codes)) for artist in store.artists],
+                              dtype=np.int64)
+        pair_artists.append(np.repeat(artist_map, np.diff(store.artist_offsets)))
+        pair_rows.append(store.artist_rows + row_offset)
+        if store.genre_offsets is not None:
+            genre_counts.append(np.diff(store.genre_offsets))
+            genre_ids.append(store.genre_ids)
+        row_offset += len(store)
+    has_genres = stores[0].genre_offsets is not None
+    return pack_store(
+        matrix=np.ascontiguousarray(np.concatenate([store.matrix for store in stores])),
+        ids=StringTable.concat([store.ids for store in stores]),
+        names=StringTable.concat([store.names for store in stores]),
+        keys=np.concatenate(keys).astype(np.int16),
+        key_labels=list(key_codes),
+        artists=StringTable.from_strings(artist_codes),
+        pair_artists=np.concatenate(pair_artists),
+        pair_rows=np.concatenate(pair_rows),
+        feature_names=stores[0].feature_names,
+        genre_counts=np.concatenate(genre_counts) if has_genres else None,
+        genre_ids=np.concatenate(genre_ids) if has_genres else None,
+    )
+
+
+class ShardedCsvLoader:  # parses data.csv with a process pool, results come back in file order
+    def __init__(self, file_path, workers, chunk_rows=50000, shards=None):
+        self.file_path = file_path
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.shards = shards or workers * SHARDS_PER_WORKER
+        self.size = os.path.getsize(file_path)
+        self.rows_parsed = 0
+        self.rows_skipped = 0
+        self.skipped_ids = []
+
+    def results(self, genre_table, columnar=True):
+        tasks = [(self.file_path, start, end, self.chunk_rows, columnar)
+                 for start, end in shard_ranges(self.file_path, self.shards)]
+        # fork where available so the workers start without re-importing everything, spawn elsewhere
+        context = get_context("fork") if os.name == "posix" else get_context()
+        with context.Pool(self.workers, initializer=init_worker, initargs=(genre_table,)) as pool:
+            for result in pool.imap(parse_shard, tasks):  # imap keeps file order while later shards still run
+                self.rows_parsed += result.rows_parsed
+                self.rows_skipped += result.rows_skipped
+                self.skipped_ids.extend(result.skipped_ids)
+                yield result
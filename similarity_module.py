@@ -1,5 +1,22 @@
 import math
 from statistical_functions import FeatureStatistics
+from artist_profiles import ArtistProfiles
+
+# Function to determine similarity outcome based on the score
+def similarity_outcome(similarity):
+    if similarity == 1:
+        return "Highly Identical"
+    elif 0.8 <= similarity < 1:
+        return "Very Similar"
+    elif 0.6 <= similarity < 0.8:
+        return "Moderately Identical"
+    elif 0.4 <= similarity < 0.6:
+        return "Slightly Identical"
+    elif 0 < similarity < 0.4:
+        return "Not Identical"
+    else:
+        return "Completely Dissimilar"
+
 class SimilarityMeasures:
     @staticmethod
     def euclidean_similarity(features1, features2):
@@ -60,19 +77,36 @@ class SimilarityMeasures:
         return 1 / (1 + distance)  # Convert to similarity score
 
 # Function to compute similarity using selected metric
-    def compute_similarity(data, id1, id2, similarity_function, stats=None):
+    def compute_similarity(data, id1, id2, similarity_function, stats=None, normalizer=None):
        
         if id1 not in data :
             raise ValueError(f"Artist Name {id1} not found in the dataset.")
         elif id2 not in data:
             raise ValueError("Artist Name {id2} not found in the dataset.")
 
-        features1 = data[id1][0]["features"]  # Retrieve the features for the first ID
-        features2 = data[id2][0]["features"]  # Retrieve the features for the second ID
+        if normalizer is not None:  # features standardized once per loaded dataset, nothing is built per call
+            features1 = normalizer.features(id1)
+            features2 = normalizer.features(id2)
+        elif isinstance(data, ArtistProfiles):  # artists are compared on the mean of all their tracks
+            features1 = data.features(id1)
+            features2 = data.features(id2)
+        else:
+            features1 = data[id1][0]["features"]  # Retrieve the features for the first ID
+            features2 = data[id2][0]["features"]  # Retrieve the features for the second ID
 
         # Normalize features if stats are provided
-        if stats:
+        if stats and normalizer is None:
             features1 = FeatureStatistics.normalize_features(features1, stats)
             features2 = FeatureStatistics.normalize_features(features2, stats)
 
         return similarity_function(features1, features2)
+
+
+# metric name -> function, for callers that get the metric as text (batch_cli, the service, the result cache)
+SIMILARITY_FUNCTIONS = {
+    "euclidean": SimilarityMeasures.euclidean_similarity,
+    "cosine": SimilarityMeasures.cosine_similarity,
+    "pearson": SimilarityMeasures.pearson_similarity,
+    "jaccard": SimilarityMeasures.jaccard_similarity,
+    "manhattan": SimilarityMeasures.manhattan_similarity,
+}
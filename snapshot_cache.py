@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from feature_store import ColumnarFeatureStore, StringTable
+from genre_table import GenreTable
+
+SNAPSHOT_VERSION = 3  # bump whenever the files written below change shape or meaning
+SAMPLE_BYTES = 1 << 20  # how much of the head and tail of a csv goes into its quick content hash
+
+
+def file_fingerprint(path, full_hash=False):
+    # size and mtime catch normal edits, the head/tail hash catches rewrites that kept both,
+    # the full hash is only computed when asked for because it reads the whole file
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        if full_hash:
+            for block in iter(lambda: file.read(SAMPLE_BYTES), b""):
+                digest.update(block)
+        else:
+            digest.update(file.read(SAMPLE_BYTES))
+            if stat.st_size > 2 * SAMPLE_BYTES:
+                file.seek(-SAMPLE_BYTES, os.SEEK_END)
+                digest.update(file.read(SAMPLE_BYTES))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest(), "full": full_hash}
+
+
+def prefix_digest(path, length):
+    # hash of the first min(length, SAMPLE_BYTES) bytes, tells a file that was only appended to from a rewritten one
+    with open(path, "rb") as file:
+        return hashlib.blake2b(file.read(min(length, SAMPLE_BYTES)), digest_size=16).hexdigest()
+
+
+def array_digest(array):
+    # checksum of an array's bytes, stored in meta.json so a snapshot whose files were damaged is not trusted
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(memoryview(np.ascontiguousarray(array)).cast("B"))
+    return digest.hexdigest()
+
+
+def valid_csr(offsets, values, rows, limit):
+    # offsets of a CSR table start at 0, never go down and end at len(values); every value is in [0, limit)
+    if len(offsets) != rows + 1 or (len(offsets) and (offsets[0] != 0 or offsets[-1] != len(values))):
+        return False
+    if len(offsets) > 1 and np.any(np.diff(offsets) < 0):
+        return False
+    return not len(values) or (values.min() >= 0 and values.max() < limit)
+
+
+def valid_store(store, genre_count):
+    # the index arrays stay inside the tables they point into, so no lookup on the store can go out of range
+    tracks = len(store.matrix)
+    if store.matrix.shape != (len(store.ids), len(store.feature_names)) or len(store.names) != tracks:
+        return False
+    if len(store.keys) != tracks or (tracks and (store.keys.min() < -1 or store.keys.max() >= len(store.key_labels))):
+        return False
+    if not valid_csr(store.artist_offsets, store.artist_rows, len(store.artists), tracks):
+        return False
+    return store.genre_offsets is None or valid_csr(store.genre_offsets, store.genre_ids, tracks, genre_count)
+
+
+class SnapshotCache:  # binary copy of a parsed dataset kept next to data.csv and memory mapped on later loads
+    def __init__(self, file_path, genre_file_path, full_hash=False):
+        self.file_path = file_path
+        self.genre_file_path = genre_file_path
+        self.full_hash = full_hash
+        self.path = file_path + ".snapshot"
+
+    def sources(self):
+        return {
+            "data": file_fingerprint(self.file_path, self.full_hash),
+            "genres": file_fingerprint(self.genre_file_path, self.full_hash),
+        }
+
+    def load(self):
+        # returns (store, genre_data), or None when there is no snapshot or it is stale or unreadable
+        try:
+            with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("version") != SNAPSHOT_VERSION or meta.get("sources") != self.sources():
+                return None
+            arrays = {name: np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+            if any(array_digest(array) != meta["checksums"][name] for name, array in arrays.items()):
+                return None
+            store = ColumnarFeatureStore(
+                matrix=arrays["matrix"],
+                ids=StringTable(arrays["ids_blob"], arrays["ids_offsets"]),
+                names=StringTable(arrays["names_blob"], arrays["names_offsets"]),
+                keys=arrays["keys"],
+                key_labels=meta["key_labels"],
+                artists=StringTable(arrays["artists_blob"], arrays["artists_offsets"]),
+                artist_offsets=arrays["artist_offsets"],
+                artist_rows=arrays["artist_rows"],
+                feature_names=meta["feature_names"],
+                genre_offsets=arrays.get("genre_offsets"),
+                genre_ids=arrays.get("genre_ids"),
+            )
+            genre_data = GenreTable(
+                names=StringTable(arrays["genre_names_blob"], arrays["genre_names_offsets"]),
+                keys=StringTable(arrays["genre_keys_blob"], arrays["genre_keys_offsets"]),
+                matrix=arrays["genre_matrix"],
+                feature_names=meta["genre_features"],
+            )
+            if not valid_store(store, len(genre_data.names)):
+                return None
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None  # missing or corrupted files, the caller parses the csv instead
+        return store, genre_data
+
+    def save(self, store, genre_data):
+        genre_keys = StringTable.from_strings(genre_data.keys)
+        genre_names = StringTable.from_strings(genre_data.names)
+        arrays = {
+            "matrix": store.matrix,
+            "ids_blob": np.frombuffer(store.ids.blob, dtype=np.uint8),
+            "ids_offsets": store.ids.offsets,
+            "names_blob": np.frombuffer(store.names.blob, dtype=np.uint8),
+            "names_offsets": store.names.offsets,
+            "keys": store.keys,
+            "artists_blob": np.frombuffer(store.artists.blob, dtype=np.uint8),
+            "artists_offsets": store.artists.offsets,
+            "artist_offsets": store.artist_offsets,
+            "artist_rows": store.artist_rows,
+            "genre_keys_blob": np.frombuffer(genre_keys.blob, dtype=np.uint8),
+            "genre_keys_offsets": genre_keys.offsets,
+            "genre_names_blob": np.frombuffer(genre_names.blob, dtype=np.uint8),
+            "genre_names_offsets": genre_names.offsets,
+            "genre_matrix": genre_data.matrix,
+        }
+        if store.genre_offsets is not None:
+            arrays["genre_offsets"] = store.genre_offsets
+            arrays["genre_ids"] = store.genre_ids
+        meta = {
+            "version": SNAPSHOT_VERSION,
+            "sources": self.sources(),
+            "arrays": sorted(arrays),
+            "checksums": {name: array_digest(array) for name, array in arrays.items()},
+            "feature_names": list(store.feature_names),
+            "key_labels": list(store.key_labels),
+            "genre_features": list(genre_data.feature_names),
+        }
+        # write into a temporary directory and swap it in, so a crash never leaves half a snapshot behind
+        temp_path = self.path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, name + ".npy"), np.ascontiguousarray(array))
+        with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)  # written last, a snapshot without meta.json is never read
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(temp_path, self.path)
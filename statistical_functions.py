@@ -1,43 +1,35 @@
-from collections import Counter
+from feature_store import ArtistMusicView, INTEGER_FEATURES
+from genre_table import SharedGroups
+from streaming_stats import SCAN_SHIFT, StreamingStatistics, scan_positions
+
+
 class FeatureStatistics:
     def __init__(self, data):
       
         self.data = data
         
     def calculate_statistics(self):
-       
-        stats = {}
-        
-        all_features = [] #an empty list ti store features
-        for key, items in self.data.items(): #looping the dictionary to get data
-            for entry in items: #extracting values
-            
-                
-                all_features.append(entry["features"]) #extracting feature inside the values and storing them into all_features list
-
-        # Extract feature names from the first feature set
-        feature_names = all_features[0].keys()
-
-        # Compute statistics for each feature
-        for feature in feature_names:
-            values = [f[feature] for f in all_features if feature in f] #iterating through each feature i.e loudness,valence etc
-            stats[feature] = {
-                #formula to calculate mean,min,max,variance,std
-                "mean": sum(values) / len(values),
-                "min": min(values),
-                "max": max(values),
-                "variance": sum((x - (sum(values) / len(values))) ** 2 for x in values) / len(values),
-                "std_dev": (sum((x - (sum(values) / len(values))) ** 2 for x in values) / len(values)) ** 0.5,
-            }
-      
-            freq = Counter(values)  # Count the frequency of each value
-            mode_data = freq.most_common()  # Get a list of value, frequency
-
-            mode = mode_data[0][0]  # The first item in the list will be the most frequent value
+        # mean, min, max, variance, std_dev and mode of every feature in a single pass over the data.
+        # values are folded into running moments chunk by chunk (see streaming_stats) instead of
+        # recomputing the mean for every element
+        return self.streaming_statistics().results()
 
-            # Store the mode in the stats dictionary
-            stats[feature]["mode"] = mode
-        return stats
+    def streaming_statistics(self): #the running moments behind calculate_statistics, more rows can be merged in later
+        if isinstance(self.data, ArtistMusicView): #columnar data, read the artists' rows straight from the matrix
+            store = self.data.store
+            return StreamingStatistics().add_matrix(store.matrix, store.feature_names, INTEGER_FEATURES,
+                                                    rows=store.artist_rows, positions=scan_positions(store.artist_offsets))
+        # tracks joined on key share one GenreRefs, each distinct list of entries is read once and counted as many
+        # times as it occurs. first occurrences keep their order, so ties for the mode still go the same way
+        groups = SharedGroups.of(self.data)
+        if len(groups) == len(self.data):  # nothing shared, e.g. artist_music. positions let update_data merge in order
+            return StreamingStatistics().add_entries(
+                (entry["features"] for items in groups.items for entry in items),
+                positions=(key << SCAN_SHIFT | entry for key, items in enumerate(groups.items)
+                           for entry in range(len(items))))
+        return StreamingStatistics().add_entries((entry["features"] for items in groups.items for entry in items),
+                                                 (count for items, count in zip(groups.items, groups.counts())
+                                                  for _ in items))
     
     #z-square normalization to ensure each featues equally contributes in similarity calculation 
     @staticmethod
@@ -0,0 +1,179 @@
+from collections import Counter
+from itertools import repeat
+
+import numpy as np
+
+CHUNK_ROWS = 65536  # values gathered per feature before they are folded into the running moments
+SCAN_SHIFT = 32  # scan position of entry j of the i-th key is i << SCAN_SHIFT | j
+
+
+def scan_positions(offsets):
+    # scan positions of every entry of a CSR table (entries of key i are offsets[i]:offsets[i + 1])
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    keys = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+    return keys << SCAN_SHIFT | (np.arange(offsets[-1] - offsets[0], dtype=np.int64) - (offsets[keys] - offsets[0]))
+
+
+class RunningStats:  # count, mean, sum of squared deviations, min, max and value counts of one feature
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of (x - mean) ** 2, variance is m2 / count
+        self.minimum = None
+        self.maximum = None
+        self.counts = Counter()  # keeps first-seen order, so ties for the mode go to the earliest value like before
+        # value -> scan position of its first occurrence, kept when values come with positions. entries merged in
+        # later (update_data) can land before old ones in a scan of the data, this keeps the mode tie-break right
+        self.first_seen = None
+        self.last_position = -1  # highest position in first_seen
+
+    def add_values(self, values, weights=None, positions=None):
+        # fold a chunk of values in: moments of the chunk are computed in numpy, then merged with Chan's formula.
+        # weights, when given, says how many times each value occurs (an entry shared by that many tracks),
+        # positions where each value sits in a scan of the data
+        if not values:
+            return
+        if positions is not None:
+            self.add_positions(values, positions)
+        elif self.count:
+            self.first_seen = None  # values without a place in the scan, fall back to first-seen order
+        array = np.asarray(values, dtype=np.float64)
+        if weights is None:
+            chunk_mean = float(array.mean())
+            centered = array - chunk_mean
+            self.merge_moments(len(values), chunk_mean, float(centered @ centered), min(values), max(values))
+            self.counts.update(values)
+            return
+        weight_array = np.asarray(weights, dtype=np.float64)
+        total = int(sum(weights))
+        chunk_mean = float(weight_array @ array / total)
+        centered = array - chunk_mean
+        self.merge_moments(total, chunk_mean, float(weight_array @ (centered * centered)), min(values), max(values))
+        counts = self.counts
+        for value, weight in zip(values, weights):  # same first-seen order as adding every copy one by one
+            counts[value] += weight
+
+    def add_positions(self, values, positions):
+        # earliest scan position of every distinct value in the chunk
+        positions = np.asarray(positions, dtype=np.int64)
+        values = np.asarray(values)
+        if np.any(positions[1:] < positions[:-1]):
+            order = np.argsort(positions, kind="stable")
+            positions, values = positions[order], values[order]
+        distinct, first = np.unique(values, return_index=True)
+        self.merge_first_seen(dict(zip(distinct.tolist(), positions[first].tolist())), int(positions[-1]))
+
+    def merge_first_seen(self, earliest, last_position):
+        if self.first_seen is None:
+            if self.count:
+                return  # earlier values came without positions
+            self.first_seen = {}
+        first_seen = self.first_seen
+        if min(earliest.values(), default=last_position) > self.last_position:
+            earliest.update(first_seen)  # all after what is there, e.g. the next chunk of a scan
+            self.first_seen = earliest
+        else:
+            for value, position in earliest.items():
+                if position < first_seen.get(value, position + 1):
+                    first_seen[value] = position
+        self.last_position = max(self.last_position, last_position)
+
+    def merge_moments(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minimum = minimum if self.minimum is None or minimum < self.minimum else self.minimum
+        self.maximum = maximum if self.maximum is None or maximum > self.maximum else self.maximum
+
+    def merge(self, other):
+        # combine with the stats of a later chunk or another shard
+        if other.count:
+            if other.first_seen is not None:
+                self.merge_first_seen(dict(other.first_seen), other.last_position)
+            else:
+                self.first_seen = None
+            self.merge_moments(other.count, other.mean, other.m2, other.minimum, other.maximum)
+            self.counts.update(other.counts)
+        return self
+
+    def mode(self):
+        if self.first_seen is None:
+            return self.counts.most_common(1)[0][0]
+        top = max(self.counts.values())
+        return min((value for value, count in self.counts.items() if count == top), key=self.first_seen.__getitem__)
+
+    def result(self):
+        variance = self.m2 / self.count
+        return {
+            "mean": self.mean,
+            "min": self.minimum,
+            "max": self.maximum,
+            "variance": variance,
+            "std_dev": variance ** 0.5,
+            "mode": self.mode(),
+        }
+
+
+class StreamingStatistics:  # RunningStats for every feature, filled in one pass and mergeable across chunks or shards
+    def __init__(self, feature_names=None):
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.features = {feature: RunningStats() for feature in self.feature_names or ()}
+
+    def add_entries(self, entries, weights=None, positions=None):
+        # entries are features dicts; the feature names come from the first one, like calculate_statistics did.
+        # weights and positions, when given, run alongside entries (see RunningStats.add_values)
+        pending = None  # feature -> (values, weights, positions) of the current chunk
+        for features, weight, position in zip(entries, repeat(None) if weights is None else weights,
+                                              repeat(None) if positions is None else positions):
+            if self.feature_names is None:
+                self.feature_names = list(features.keys())
+                self.features = {feature: RunningStats() for feature in self.feature_names}
+            if pending is None:
+                pending = {feature: ([], [], []) for feature in self.feature_names}
+            for feature, (values, chunk_weights, chunk_positions) in pending.items():
+                if feature in features:
+                    values.append(features[feature])
+                    chunk_weights.append(weight)
+                    chunk_positions.append(position)
+            if len(pending[self.feature_names[0]][0]) >= CHUNK_ROWS:
+                self.flush(pending, weights is not None, positions is not None)
+                pending = None
+        if pending is not None:
+            self.flush(pending, weights is not None, positions is not None)
+        return self
+
+    def add_matrix(self, matrix, feature_names, integer_features=(), rows=None, positions=None):
+        # columnar input, optionally only the given rows (in that order); integer features are counted as ints.
+        # positions, when given, is the scan position of every row read
+        if self.feature_names is None:
+            self.feature_names = list(feature_names)
+            self.features = {feature: RunningStats() for feature in self.feature_names}
+        total = matrix.shape[0] if rows is None else len(rows)
+        for start in range(0, total, CHUNK_ROWS):
+            block = matrix[start:start + CHUNK_ROWS] if rows is None else matrix[rows[start:start + CHUNK_ROWS]]
+            block_positions = positions[start:start + CHUNK_ROWS] if positions is not None else None
+            for column, feature in enumerate(feature_names):
+                if feature in self.features:
+                    values = block[:, column].tolist()
+                    values = list(map(int, values)) if feature in integer_features else values
+                    self.features[feature].add_values(values, None, block_positions)
+        return self
+
+    def flush(self, pending, weighted, positioned):
+        for feature, (values, weights, positions) in pending.items():
+            self.features[feature].add_values(values, weights if weighted else None, positions if positioned else None)
+
+    def merge(self, other):
+        if self.feature_names is None:
+            self.feature_names = list(other.feature_names or ())
+            self.features = {feature: RunningStats() for feature in self.feature_names}
+        for feature, stats in other.features.items():
+            if feature in self.features:
+                self.features[feature].merge(stats)
+        return self
+
+    def results(self):
+        return {feature: stats.result() for feature, stats in self.features.items() if stats.count}
@@ -0,0 +1,19 @@
+import os
+import sys
+
+# the modules sit at the repository root, next to this directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# data.csv header and row builder shared by the suites that write their own small csv files
+HEADER = ("valence,year,acousticness,artists,danceability,duration_ms,energy,explicit,id,instrumentalness,key,"
+          "liveness,loudness,mode,name,popularity,release_date,speechiness,tempo")
+GENRES_HEADER = HEADER + ",genres"  # exports that list each track's genres
+
+
+def row(track_id, artists, name="Title", key=5, energy="0.5", tempo="120.0", genres=None):
+    # artists (and genres) are written as given, quote them when the list has a comma
+    line = (f"0.3,1990,0.1,{artists},0.6,200000,{energy},0,{track_id},0.0,{key},"
+            f"0.2,-7.5,1,{name},40,1990,0.05,{tempo}")
+    return line if genres is None else f"{line},{genres}"
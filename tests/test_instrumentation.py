@@ -0,0 +1,34 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+# python instrumentation.py <script> must see the counters and the similarity calls of the modules the script uses
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    {"kind": "artist", "id1": "Sergei Rachmaninoff", "id2": "Dennis Day", "metric": "cosine"},
+    {"kind": "artist", "id1": "Dennis Day", "id2": "Sergei Rachmaninoff", "metric": "cosine"},  # result cache hit
+    {"kind": "track", "feature": "energy", "criterion": "highest"},
+]
+
+
+def test_cli_report_has_counters(tmp_path):
+    data = str(tmp_path / "data.csv")
+    genres = str(tmp_path / "genres.csv")
+    shutil.copy(os.path.join(ROOT, "dataset", "example.csv"), data)
+    shutil.copy(os.path.join(ROOT, "dataset", "exampleg.csv"), genres)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text("".join(json.dumps(query) + "\n" for query in QUERIES), encoding="utf-8")
+    report_path = tmp_path / "report.json"
+    subprocess.run([sys.executable, os.path.join(ROOT, "instrumentation.py"), "--json", str(report_path),
+                    os.path.join(ROOT, "batch_cli.py"), str(queries), "--data", data, "--genres", genres,
+                    "--output", str(tmp_path / "out.jsonl"), "--workers", "1"],
+                   check=True, cwd=str(tmp_path), capture_output=True)
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["counters"]["snapshot_misses"] == 1
+    assert report["counters"]["result_cache_hits"] == 1
+    assert report["stages"]["SimilarityMeasures.cosine_similarity"]["calls"] == 1
+    assert report["stages"]["MusicDataProcessor.load_data"]["rows"] > 0
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from conftest import HEADER, row
+from load_data_set import MusicDataProcessor
+
+# the block loader (dict and columnar mode) must give the same artist_music / music_features as the original
+# character by character parser, load_music_data_legacy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, "dataset", "example.csv")
+GENRES = os.path.join(ROOT, "dataset", "exampleg.csv")
+
+# (line, is it skipped)
+ROWS = [
+    (row("t01", "['Solo Artist']", "Plain Title"), False),
+    (row("t02", "\"['First Artist', 'Second Artist', 'Third Artist']\"", "Duet"), False),
+    (row("t03", "\"['First Artist', 'Fourth Artist']\"", "\"Concerto No. 1, Op. 23: I. Allegro, ma non troppo\""), False),
+    (row("t04", "['Solo Artist']", "\"Hello, Goodbye\"", key=0), False),
+    (row("t05", "\"['Second Artist', 'Solo Artist']\"", "Bad Energy", energy="loud"), True),
+    (row("t06", "['Fifth Artist']", "Empty Tempo", tempo=""), True),
+    (row("t07", "['Fifth Artist']", "No Key", key=""), False),
+    (row("t08", "\"['Sixth Artist', 'First Artist']\"", "\"Commas, Commas, Commas\"", key=11), False),
+]
+
+
+@pytest.fixture
+def generated_csv(tmp_path):
+    path = tmp_path / "data.csv"
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.write("\r\n".join([HEADER] + [line for line, _ in ROWS]) + "\r\n")  # crlf line endings
+    return str(path)
+
+
+def plain(data):
+    # entries hold FeatureRow / GenreRefs views in columnar mode, compare them as the plain dicts the legacy parser makes
+    return {key: [{field: dict(value) if field == "features" else value for field, value in dict(entry).items()}
+                  for entry in entries]
+            for key, entries in data.items()}
+
+
+def legacy(file_path):
+    processor = MusicDataProcessor(file_path, GENRES)
+    processor.load_music_data_legacy(processor.load_genre_data())
+    return processor
+
+
+def loaded(file_path, columnar):
+    processor = MusicDataProcessor(file_path, GENRES, columnar=columnar)
+    processor.load_data()
+    return processor
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_example_matches_legacy(columnar):
+    expected = legacy(EXAMPLE)
+    processor = loaded(EXAMPLE, columnar)
+    assert plain(processor.get_artist_music()) == plain(expected.artist_music)
+    assert plain(processor.get_music_features()) == plain(expected.music_features)
+    assert processor.load_report["skipped"] == 0
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_generated_matches_legacy(generated_csv, columnar):
+    expected = legacy(generated_csv)
+    processor = loaded(generated_csv, columnar)
+    artist_music = plain(processor.get_artist_music())
+    assert artist_music == plain(expected.artist_music)
+    assert plain(processor.get_music_features()) == plain(expected.music_features)
+    assert processor.load_report["skipped"] == sum(skipped for _, skipped in ROWS)
+    assert processor.load_report["rows"] == len(ROWS) - processor.load_report["skipped"]
+    # the quoted lists and titles came through whole
+    assert [entry["id"] for entry in artist_music["First Artist"]] == ["t02", "t03", "t08"]
+    assert artist_music["Sixth Artist"][0]["name"] == "Commas, Commas, Commas"
+    assert artist_music["First Artist"][1]["name"] == "Concerto No. 1, Op. 23: I. Allegro, ma non troppo"
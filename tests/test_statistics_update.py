@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from conftest import GENRES_HEADER, HEADER, row
+from load_data_set import MusicDataProcessor
+from statistical_functions import FeatureStatistics
+
+# statistics merged in by update_data must match a fresh calculate_statistics of the updated data, mode tie-break
+# (first value in a scan of artist_music) included
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENRES = os.path.join(ROOT, "dataset", "exampleg.csv")
+
+# energy 0.2 and 0.3 both end up twice. a scan of artist_music sees Artist A's appended 0.3 before Artist B's 0.2
+FIRST = [row("t1", "['Artist A']", energy="0.1"), row("t2", "['Artist B']", energy="0.2"),
+         row("t3", "['Artist C']", energy="0.2")]
+APPENDED = [row("t4", "['Artist A']", energy="0.3"), row("t5", "['Artist B']", energy="0.3"),
+            row("t6", "['Artist D']", energy="0.4")]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_artist_mode_after_update(tmp_path, columnar):
+    path = str(tmp_path / "data.csv")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join([HEADER] + FIRST) + "\n")
+    processor = MusicDataProcessor(path, GENRES, columnar=columnar)
+    processor.load_data()
+    processor.get_statistics("artist")
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("\n".join(APPENDED) + "\n")
+    processor.update_data()
+    updated = processor.get_statistics("artist")
+    fresh = FeatureStatistics(processor.artist_music).calculate_statistics()
+    assert updated["energy"]["mode"] == fresh["energy"]["mode"] == 0.3
+    for feature, values in fresh.items():
+        assert updated[feature]["mode"] == values["mode"]
+        assert updated[feature]["mean"] == pytest.approx(values["mean"])
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_genres_column_after_update_from_empty(tmp_path, columnar):
+    # a header only data.csv with a genres column, then rows: tracks join the genres they list, not their key
+    path = str(tmp_path / "data.csv")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(GENRES_HEADER + "\n")
+    processor = MusicDataProcessor(path, GENRES, columnar=columnar)
+    processor.load_data()
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("\n".join([row("t1", "['Artist A']", genres="['432hz']"),
+                              row("t2", "['Artist B']", genres="\"['21st century classical', '432hz']\""),
+                              row("t3", "['Artist A']", genres="[]")]) + "\n")
+    processor.update_data()
+    fresh = MusicDataProcessor(path, GENRES, columnar=columnar)
+    fresh.load_data()
+    updated = {track_id: [genre["genre_name"] for genre in genres] for track_id, genres in processor.music_features.items()}
+    assert updated == {track_id: [genre["genre_name"] for genre in genres] for track_id, genres in fresh.music_features.items()}
+    assert updated["t1"] == ["432hz"]